@@ -0,0 +1,178 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from match_index import hash_file, index_key
+from task_metrics import ANALYSIS_CACHE_STATS_KEY
+
+# Cached source videos are evicted least-recently-used first once together they
+# take more than this much disk.
+ANALYSIS_CACHE_MAX_MB = int(os.environ.get('ANALYSIS_CACHE_MAX_MB', 20480))
+# A source used within this many seconds is never evicted, so an export that is
+# still reading it doesn't lose it.
+ANALYSIS_CACHE_MIN_AGE = float(os.environ.get('ANALYSIS_CACHE_MIN_AGE', 3600))
+# Tasks reading a source touch it this often, so one that runs longer than
+# ANALYSIS_CACHE_MIN_AGE (a long encode or Whisper run) still keeps it.
+SOURCE_TOUCH_INTERVAL = ANALYSIS_CACHE_MIN_AGE / 4
+
+SOURCE_RECORD = 'source.json'
+
+
+def url_source_key(url, youtube_video_id=None):
+    """A YouTube video is the same source whichever URL form it was submitted with."""
+    if youtube_video_id:
+        return f"yt-{youtube_video_id}"
+    return f"url-{hashlib.sha256(url.strip().encode('utf-8')).hexdigest()[:32]}"
+
+
+def file_source_key(video_path):
+    return f"sha-{hash_file(video_path)[:32]}"
+
+
+def touch_source(video_path):
+    """Marks a cached video as just used. Videos outside the cache are left alone."""
+    record_path = os.path.join(os.path.dirname(video_path), SOURCE_RECORD)
+    if os.path.exists(record_path):
+        os.utime(record_path)
+
+
+@contextmanager
+def source_in_use(video_path, interval=SOURCE_TOUCH_INTERVAL):
+    """Touches the source now and every `interval` seconds until the block exits."""
+    touch_source(video_path)
+    done = threading.Event()
+
+    def keep_touching():
+        while not done.wait(interval):
+            try:
+                touch_source(video_path)
+            except OSError as e:
+                print(f"Could not touch cached source {video_path}: {e}")
+
+    toucher = threading.Thread(target=keep_touching, daemon=True)
+    toucher.start()
+    try:
+        yield
+    finally:
+        done.set()
+        toucher.join()
+
+
+def _write_json(path, data):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class AnalysisCache:
+    """
+    Downloaded/uploaded videos and their analysis results, kept in uploads/sources/.
+
+    Each source is addressed by its URL/YouTube id or by the hash of the uploaded file
+    and gets a directory holding the video, its transcripts, a source.json record, one
+    analysis-<key>.json per set of analysis settings and the index-<key>.npz match-score
+    indexes built from it. The mtime of source.json is the source's last-used time.
+    A URL or upload seen before isn't downloaded again, and one already analyzed with
+    the same templates and settings gets its stored segments and thumbnails back.
+    """
+
+    def __init__(self, upload_dir, max_mb=ANALYSIS_CACHE_MAX_MB, min_age=ANALYSIS_CACHE_MIN_AGE):
+        self.sources_dir = os.path.join(upload_dir, 'sources')
+        self.max_bytes = max_mb * 1024 * 1024
+        self.min_age = min_age
+
+    def source_dir(self, source_key):
+        path = os.path.join(self.sources_dir, source_key)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def get_source(self, source_key):
+        """Path of the cached video for `source_key`, or None."""
+        record_path = os.path.join(self.sources_dir, source_key, SOURCE_RECORD)
+        record = _read_json(record_path)
+        if not record or not os.path.exists(record['video_path']):
+            return None
+        os.utime(record_path)
+        return record['video_path']
+
+    def put_source(self, source_key, video_path):
+        """
+        Registers `video_path` as the source for `source_key`, moving it into the
+        source's directory first if it isn't there yet. Returns the cached path.
+        """
+        source_dir = self.source_dir(source_key)
+        if os.path.dirname(os.path.abspath(video_path)) != os.path.abspath(source_dir):
+            cached_path = os.path.join(source_dir, os.path.basename(video_path))
+            shutil.move(video_path, cached_path)
+            video_path = cached_path
+        _write_json(os.path.join(source_dir, SOURCE_RECORD), {'video_path': video_path})
+        return video_path
+
+    def analysis_key(self, source_key, template_fingerprint, **settings):
+        return index_key(source_key, template_fingerprint, **settings)
+
+    def get_analysis(self, source_key, key):
+        """
+        The stored analysis result, or None. A result whose video or thumbnails have
+        since been removed counts as a miss.
+        """
+        record = _read_json(os.path.join(self.sources_dir, source_key, f"analysis-{key}.json"))
+        if not record or not self.get_source(source_key):
+            return None
+        if not all(os.path.exists(path) for path in record['thumbnail_files']):
+            return None
+        return record['result']
+
+    def put_analysis(self, source_key, key, result, thumbnail_files):
+        _write_json(os.path.join(self.source_dir(source_key), f"analysis-{key}.json"),
+                    {'result': result, 'thumbnail_files': thumbnail_files})
+
+    def evict(self):
+        """
+        Removes the least recently used sources (video, transcripts, match indexes,
+        results and their thumbnails) until the rest fit in max_bytes. Returns the
+        evicted source keys.
+        """
+        sources = []
+        for source_dir in glob.glob(os.path.join(glob.escape(self.sources_dir), '*', '')):
+            record_path = os.path.join(source_dir, SOURCE_RECORD)
+            if not os.path.exists(record_path):
+                # A download that is still running or never completed.
+                contents = glob.glob(os.path.join(glob.escape(source_dir), '*')) + [source_dir]
+                if time.time() - max(os.path.getmtime(path) for path in contents) > self.min_age:
+                    shutil.rmtree(source_dir, ignore_errors=True)
+                continue
+            size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(glob.escape(source_dir), '*')))
+            sources.append((os.path.getmtime(record_path), os.path.normpath(source_dir), size))
+
+        total_bytes = sum(size for _, _, size in sources)
+        evicted = []
+        now = time.time()
+        for last_used, source_dir, size in sorted(sources):
+            if total_bytes <= self.max_bytes:
+                break
+            if now - last_used < self.min_age:
+                continue
+            for result_path in glob.glob(os.path.join(glob.escape(source_dir), 'analysis-*.json')):
+                for thumbnail_path in (_read_json(result_path) or {}).get('thumbnail_files', []):
+                    if os.path.exists(thumbnail_path):
+                        os.remove(thumbnail_path)
+            shutil.rmtree(source_dir, ignore_errors=True)
+            total_bytes -= size
+            evicted.append(os.path.basename(source_dir))
+        if evicted:
+            print(f"Evicted {len(evicted)} cached source(s); {total_bytes / 1024 / 1024:.0f} MB remain.")
+        return evicted
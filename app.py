@@ -1,13 +1,14 @@
-from flask import Flask, request, render_template, send_from_directory, flash, redirect, url_for, jsonify
+from flask import Flask, request, render_template, send_from_directory, flash, redirect, url_for, jsonify, Response
 import os
-import yt_dlp
 from werkzeug.utils import secure_filename
 import json
 import traceback
 import re
-from moviepy.editor import VideoFileClip
 from celery_config import celery
-from process_video import start_analysis_task, process_video_segments, process_and_concatenate_segments
+from segment_cutting import CUT_MODES
+from channel_listing import claim_refresh, invalidate_listing, read_channel_url, read_listing, save_channel_url
+from task_metrics import prometheus_text
+from transcripts import choose_transcription_mode
 
 UPLOAD_FOLDER = 'uploads'
 RESULTS_FOLDER = 'results'
@@ -25,8 +26,6 @@ os.makedirs(RESULTS_FOLDER, exist_ok=True)
 os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)
 os.makedirs(CONFIG_FOLDER, exist_ok=True)
 
-CHANNEL_URL_FILE = os.path.join(CONFIG_FOLDER, 'channel_url.txt')
-
 def get_youtube_video_id(url):
     """Extracts the YouTube video ID from various URL formats."""
     if not isinstance(url, str):
@@ -46,18 +45,24 @@ def get_youtube_video_id(url):
 def index():
     if request.method == 'POST':
         sensitivity = int(request.form.get('sensitivity', 80))
+        sample_interval = float(request.form.get('sample_interval') or 1.0)
+        full_scan = bool(request.form.get('full_scan'))
+        all_occurrences = bool(request.form.get('all_occurrences'))
         
         submitted_url = request.form.get('url')
 
         if submitted_url:
             video_id = get_youtube_video_id(submitted_url)
-            task = start_analysis_task.delay(
+            task = celery.send_task('process_video.start_analysis_task', kwargs=dict(
                 sensitivity=sensitivity, 
                 upload_dir=app.config['UPLOAD_FOLDER'], 
                 thumbnail_dir=THUMBNAIL_FOLDER,
                 url=submitted_url,
-                youtube_video_id=video_id
-            )
+                youtube_video_id=video_id,
+                sample_interval=sample_interval,
+                full_scan=full_scan,
+                all_occurrences=all_occurrences
+            ))
             return redirect(url_for('analysis_status', task_id=task.id))
 
         elif 'file' in request.files and request.files['file'].filename != '':
@@ -67,12 +72,15 @@ def index():
                 video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
                 file.save(video_path)
                 
-                task = start_analysis_task.delay(
+                task = celery.send_task('process_video.start_analysis_task', kwargs=dict(
                     sensitivity=sensitivity, 
                     thumbnail_dir=THUMBNAIL_FOLDER,
                     video_path=video_path,
-                    upload_dir=app.config['UPLOAD_FOLDER']
-                )
+                    upload_dir=app.config['UPLOAD_FOLDER'],
+                    sample_interval=sample_interval,
+                    full_scan=full_scan,
+                    all_occurrences=all_occurrences
+                ))
                 return redirect(url_for('analysis_status', task_id=task.id))
             else:
                 flash('Invalid file type.')
@@ -81,44 +89,35 @@ def index():
             flash('No file or URL provided.')
             return redirect(url_for('index'))
 
-    # This part handles displaying the main page on a GET request
-    saved_channel_url = ""
-    if os.path.exists(CHANNEL_URL_FILE):
-        with open(CHANNEL_URL_FILE, 'r') as f:
-            saved_channel_url = f.read().strip()
-
-    latest_videos = []
+    # This part handles displaying the main page on a GET request. The channel listing
+    # comes from the cache the beat task keeps fresh; a missing or stale listing is
+    # shown as it is and refreshed in the background.
+    saved_channel_url = read_channel_url()
+    listing = None
     if saved_channel_url:
         try:
-            print(f"Fetching latest videos from channel's /streams endpoint: {saved_channel_url}")
-            ydl_opts = {
-                'playlistend': 5,
-                'quiet': True,
-                'ignoreerrors': True,
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                result = ydl.extract_info(f"{saved_channel_url}/streams", download=False)
-                
-                if 'entries' in result and result['entries'] is not None:
-                    for entry in result['entries']:
-                        if entry and entry.get('duration'):
-                            latest_videos.append({
-                                'title': entry.get('title'),
-                                'url': entry.get('original_url') or f"https://www.youtube.com/watch?v={entry.get('id')}",
-                                'thumbnail': entry.get('thumbnail')
-                            })
-                        if len(latest_videos) == 3:
-                            break
+            listing = read_listing(celery.backend.client, saved_channel_url)
+            if (listing is None or listing['stale']) and claim_refresh(celery.backend.client, saved_channel_url):
+                celery.send_task('process_video.refresh_channel_listing', args=(saved_channel_url,))
         except Exception as e:
-            flash(f"Could not fetch videos from the channel URL. Error: {str(e)}")
+            print(f"Could not read the channel listing cache: {e}")
 
-    return render_template('upload.html', saved_channel_url=saved_channel_url, latest_videos=latest_videos)
+    return render_template('upload.html', saved_channel_url=saved_channel_url,
+                           latest_videos=listing['videos'] if listing else [],
+                           listing=listing, listing_pending=bool(saved_channel_url) and listing is None)
 
 @app.route('/save_channel', methods=['POST'])
 def save_channel():
-    channel_url = request.form.get('channel_url', '')
-    with open(CHANNEL_URL_FILE, 'w') as f:
-        f.write(channel_url)
+    channel_url = request.form.get('channel_url', '').strip()
+    previous_url = read_channel_url()
+    save_channel_url(channel_url)
+    try:
+        for url in {previous_url, channel_url} - {''}:
+            invalidate_listing(celery.backend.client, url)
+        if channel_url and claim_refresh(celery.backend.client, channel_url):
+            celery.send_task('process_video.refresh_channel_listing', args=(channel_url,))
+    except Exception as e:
+        print(f"Could not reset the channel listing cache: {e}")
     flash("Channel URL saved successfully!")
     return redirect(url_for('index'))
 
@@ -193,11 +192,23 @@ def process_video_route():
             return jsonify({'error': 'No segments or formats were selected for processing.'}), 400
 
         should_concatenate = request.form.get('concatenate_segments')
+        transcription_mode = request.form.get('transcription_mode', 'auto')
+        if transcription_mode == 'auto':
+            transcription_mode = choose_transcription_mode(jobs, video_duration)
+        if transcription_mode not in ('segment', 'source'):
+            return jsonify({'error': f'Unknown transcription mode: {transcription_mode}'}), 400
+        cut_mode = request.form.get('cut_mode', 'exact')
+        if cut_mode not in CUT_MODES:
+            return jsonify({'error': f'Unknown cut mode: {cut_mode}'}), 400
         
         if should_concatenate:
-            task = process_and_concatenate_segments.delay(video_path, jobs, app.config['RESULTS_FOLDER'])
+            task = celery.send_task('process_video.process_and_concatenate_segments',
+                                    args=(video_path, jobs, app.config['RESULTS_FOLDER']),
+                                    kwargs={'transcription_mode': transcription_mode, 'cut_mode': cut_mode})
         else:
-            task = process_video_segments.delay(video_path, jobs, app.config['RESULTS_FOLDER'])
+            task = celery.send_task('process_video.process_video_segments',
+                                    args=(video_path, jobs, app.config['RESULTS_FOLDER']),
+                                    kwargs={'transcription_mode': transcription_mode, 'cut_mode': cut_mode})
         
         return jsonify({'task_id': task.id})
 
@@ -212,12 +223,16 @@ def task_status(task_id):
     if task.state == 'PENDING':
         response = {'state': task.state, 'status': 'Pending...'}
     elif task.state != 'FAILURE':
+        info = task.info if isinstance(task.info, dict) else {}
         response = {
             'state': task.state,
-            'status': task.info.get('status', '') if isinstance(task.info, dict) else str(task.info)
+            'status': info.get('status', '') if isinstance(task.info, dict) else str(task.info),
+            'percent': 100 if task.state == 'SUCCESS' else info.get('percent'),
         }
         if task.state == 'SUCCESS':
-            response['result'] = task.info.get('result', {})
+            response['result'] = info.get('result', {})
+            response['timings'] = info.get('timings', {})
+            response['counters'] = info.get('counters', {})
     else:
         response = {
             'state': task.state,
@@ -226,6 +241,12 @@ def task_status(task_id):
     return jsonify(response)
 
 
+@app.route('/metrics')
+def metrics():
+    """Task, stage and cache totals recorded by the workers, for Prometheus to scrape."""
+    return Response(prometheus_text(celery.backend.client), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/results_page/<task_id>')
 def results_page(task_id):
     task = celery.AsyncResult(task_id)
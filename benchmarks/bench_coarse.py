@@ -0,0 +1,93 @@
+"""
+Recall check for the coarse-to-fine search (video_analysis.find_first_match_coarse_to_fine).
+
+Writes short clips with the template overlaid at a given on-screen width from a
+known time, including cards shown too small for the downscaled coarse pass to see,
+and runs analyze_video_for_changes on each at several sensitivities twice: with the
+default coarse pass, and with coarse_width=None (every sample at full resolution).
+Fails if the default ever returns fewer hits than the full-resolution scan.
+
+    python benchmarks/bench_coarse.py --sensitivities 70,150,300
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from process_video import analyze_video_for_changes
+from template_registry import load_registry
+
+# (frame width, frame height, card width or None for no card)
+CLIPS = (
+    (1920, 1080, 400),
+    (1920, 1080, 800),
+    (3840, 2160, 800),
+    (3840, 2160, None),
+    (1280, 720, 300),
+    (1280, 720, None),
+)
+CARD_FROM = 10.2
+
+
+def write_clip(path, template, width, height, card_width, fps, duration, seed=0):
+    rng = np.random.default_rng(seed)
+    blobs = rng.integers(0, 256, size=(height // 16, width // 16, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(cv2.resize(blobs, (width, height)), (31, 31), 0)
+    card = None
+    if card_width:
+        card = cv2.resize(template, (card_width, int(card_width * template.shape[0] / template.shape[1])),
+                          interpolation=cv2.INTER_AREA)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    try:
+        for frame_index in range(int(duration * fps)):
+            frame = np.roll(background, frame_index * 4, axis=1)
+            if card is not None and frame_index / fps >= CARD_FROM:
+                x, y = (width - card.shape[1]) // 3, (height - card.shape[0]) // 2
+                frame[y:y + card.shape[0], x:x + card.shape[1]] = card
+            writer.write(frame)
+    finally:
+        writer.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensitivities', default='70,150,300', help='comma separated')
+    parser.add_argument('--fps', type=float, default=10)
+    parser.add_argument('--duration', type=float, default=14)
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'quick-edit-bench-coarse'))
+    args = parser.parse_args()
+    sensitivities = [int(value) for value in args.sensitivities.split(',')]
+
+    template = cv2.imread(load_registry().paths[0])
+    os.makedirs(args.work_dir, exist_ok=True)
+    failures = []
+    for width, height, card_width in CLIPS:
+        path = os.path.join(args.work_dir, f"{width}x{height}_card{card_width or 0}_{args.fps:g}fps.mp4")
+        if not os.path.exists(path):
+            write_clip(path, template, width, height, card_width, args.fps, args.duration)
+        for sensitivity in sensitivities:
+            results = {}
+            for label, coarse_width in (('coarse', 'default'), ('full', None)):
+                kwargs = {} if coarse_width == 'default' else {'coarse_width': None}
+                started = time.perf_counter()
+                hits = analyze_video_for_changes(path, sensitivity=sensitivity, shards=1, **kwargs)
+                results[label] = ([round(hit['time'], 2) for hit in hits], time.perf_counter() - started)
+            print(f"{os.path.basename(path)} sensitivity {sensitivity}: coarse-to-fine {results['coarse'][0]} "
+                  f"in {results['coarse'][1]:.1f}s, full resolution {results['full'][0]} in {results['full'][1]:.1f}s")
+            if len(results['coarse'][0]) < len(results['full'][0]):
+                failures.append(f"{os.path.basename(path)} at sensitivity {sensitivity}")
+
+    if failures:
+        print(f"FAIL: the coarse pass returned fewer hits than the full-resolution scan on: {', '.join(failures)}")
+        return 1
+    print("OK: the coarse pass never returned fewer hits than the full-resolution scan.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Import-time check for the web process.
+
+Imports app.py in a fresh interpreter (several times, keeping the fastest), reports
+how long it took and fails if it went over the budget or if any of the libraries
+only the workers need got loaded along the way. gunicorn pays this cost on every
+web worker start, so it should stay at Flask + Celery client.
+
+    python benchmarks/bench_import.py --budget 1.5 --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules the web process must never import: they belong to the worker code paths.
+WORKER_ONLY_MODULES = ('torch', 'whisper', 'cv2', 'numpy', 'moviepy', 'yt_dlp', 'process_video')
+
+IMPORT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {repo_dir!r})
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed,
+                  'loaded': [name for name in {modules!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(work_dir):
+    """One cold import of app in a new interpreter: {'seconds', 'loaded'}."""
+    script = IMPORT_SCRIPT.format(repo_dir=os.path.abspath(REPO_DIR), modules=WORKER_ONLY_MODULES)
+    # app.py creates its upload/result folders relative to the working directory.
+    result = subprocess.run([sys.executable, '-c', script], cwd=work_dir, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing app failed:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=1.5, help='maximum import time in seconds')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        runs = [measure_import(work_dir) for _ in range(args.repeat)]
+    best = min(run['seconds'] for run in runs)
+    loaded = sorted(set(name for run in runs for name in run['loaded']))
+
+    print(f"import app: best {best * 1000:.0f} ms of {args.repeat} "
+          f"(budget {args.budget * 1000:.0f} ms)")
+    failed = False
+    if loaded:
+        print(f"FAIL: worker-only modules imported by the web process: {', '.join(loaded)}")
+        failed = True
+    if best > args.budget:
+        print(f"FAIL: import took {best:.2f}s, over the {args.budget:.2f}s budget")
+        failed = True
+    if failed:
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
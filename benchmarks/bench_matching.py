@@ -0,0 +1,106 @@
+"""
+Micro-benchmark for the descriptor matching step of the template analysis.
+
+Compares, per sampled frame, the original BFMatcher.knnMatch + Python ratio-test
+loop with the NumPy backend in descriptor_matching.py, and checks both produce the
+same counts. The
+ratio-test stage is also timed on its own, on already computed neighbours, since
+the brute-force Hamming search itself costs the same in every backend.
+
+    python benchmarks/bench_matching.py --frames 200 --templates 3
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from descriptor_matching import RATIO_TEST, count_ratio_matches, nearest_two
+
+
+def knn_loop_counts(bf, des_query, labels, n_labels, des_train):
+    """The ratio test as analyze_video_for_changes used to run it."""
+    counts = np.zeros(n_labels, dtype=np.int32)
+    matches = bf.knnMatch(des_query, des_train, k=2)
+    good_matches = []
+    for match_pair in matches:
+        if len(match_pair) == 2:
+            m, n = match_pair
+            if m.distance < RATIO_TEST * n.distance:
+                good_matches.append(m)
+    for m in good_matches:
+        counts[labels[m.queryIdx]] += 1
+    return counts
+
+
+def make_descriptors(rng, frames, templates, features):
+    """
+    Random ORB-sized descriptors. Each frame reuses a slice of the template rows with a
+    few bits flipped, so the ratio test has real matches to find.
+    """
+    des_query = rng.integers(0, 256, size=(templates * features, 32), dtype=np.uint8)
+    labels = np.repeat(np.arange(templates, dtype=np.int32), features)
+    train = []
+    for _ in range(frames):
+        des_train = rng.integers(0, 256, size=(features, 32), dtype=np.uint8)
+        shared = rng.integers(0, features // 2)
+        rows = rng.choice(len(des_query), size=shared, replace=False)
+        noise = rng.integers(0, 256, size=(shared, 32), dtype=np.uint8) & rng.integers(0, 2, size=(shared, 32), dtype=np.uint8)
+        des_train[:shared] = des_query[rows] ^ noise
+        train.append(des_train)
+    return des_query, labels, train
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--templates', type=int, default=1)
+    parser.add_argument('--features', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    des_query, labels, train = make_descriptors(rng, args.frames, args.templates, args.features)
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
+
+    loop_counts, loop_time = timed(lambda: [knn_loop_counts(bf, des_query, labels, args.templates, d) for d in train])
+    vector_counts, vector_time = timed(lambda: [count_ratio_matches(des_query, labels, args.templates, d) for d in train])
+
+    loop_counts = np.vstack(loop_counts)
+    if not np.array_equal(loop_counts, np.vstack(vector_counts)):
+        print("MISMATCH: backends disagree on good-match counts")
+        return 1
+
+    knn_results = [bf.knnMatch(des_query, d, k=2) for d in train]
+    dist_results = [nearest_two(des_query, d) for d in train]
+    _, loop_ratio_time = timed(lambda: [
+        sum(1 for pair in matches if len(pair) == 2 and pair[0].distance < RATIO_TEST * pair[1].distance)
+        for matches in knn_results
+    ])
+    _, vector_ratio_time = timed(lambda: [
+        np.bincount(labels[dist[:, 0] < RATIO_TEST * dist[:, 1]], minlength=args.templates)
+        for dist in dist_results
+    ])
+
+    print(f"{args.frames} frames, {args.templates} template(s) x {args.features} features, "
+          f"mean good matches {loop_counts.sum(axis=1).mean():.1f}, OpenCV threads {cv2.getNumThreads()}")
+    print("search + ratio test:")
+    for name, seconds in (('knnMatch + loop', loop_time), ('vectorized', vector_time)):
+        print(f"  {name:<16} {seconds / args.frames * 1000:8.3f} ms/frame  ({loop_time / seconds:5.2f}x)")
+    print("ratio test only:")
+    for name, seconds in (('Python loop', loop_ratio_time), ('vectorized', vector_ratio_time)):
+        print(f"  {name:<16} {seconds / args.frames * 1000:8.3f} ms/frame  ({loop_ratio_time / seconds:5.2f}x)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+End-to-end benchmark of the analysis and export paths on synthetic videos.
+
+Generates test videos offline with ffmpeg's lavfi sources (a moving test pattern and a
+tone) at every combination of --resolutions, --durations and --fps, with the template
+shown full-frame from a known frame onwards. For each video it measures:
+
+  analysis   analyze_video_for_changes: time to the first match, video frames covered
+             per second, the found time against the known one, and optionally
+             (--full-scan) the fps of scoring the whole video
+  thumbnails extract_thumbnails for the match and the segment starts
+  export     the ffmpeg runs the export tasks make (plan_segment_exports and
+             plan_concat_export), per format and cut mode, as a realtime factor
+             (seconds of output written per second of wall time)
+
+Each stage runs in its own interpreter so its peak RSS (and that of the ffmpeg
+processes it started) is its own. Generated videos are kept in --work-dir and reused.
+Results go to --output as JSON so runs can be compared.
+
+    python benchmarks/bench_pipeline.py --resolutions 640x360,1280x720 --durations 60 --fps 30
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, REPO_DIR)
+
+# The template appears this far into each video, and stays up for SHOW_SECONDS.
+MATCH_AT = 0.7
+SHOW_SECONDS = 5.0
+
+
+def video_name(width, height, duration, fps):
+    return f"synthetic_{width}x{height}_{duration:g}s_{fps:g}fps.mp4"
+
+
+def expected_match_frame(duration, fps):
+    """First frame showing the template: deliberately not on a whole second."""
+    return int(duration * MATCH_AT * fps) + int(fps // 3)
+
+
+def generate_video(path, template_path, width, height, duration, fps):
+    """Test pattern + tone with the template overlaid from expected_match_frame()."""
+    start_frame = expected_match_frame(duration, fps)
+    # Half a frame of slack either side so the overlay starts on exactly that frame.
+    show_from = (start_frame - 0.5) / fps
+    show_until = show_from + SHOW_SECONDS
+    filters = (f"[2:v]scale={width}:{height},setsar=1[template];"
+               f"[0:v][template]overlay=enable='between(t,{show_from:.6f},{show_until:.6f})':shortest=1[v]")
+    args = ['ffmpeg', '-y', '-v', 'error',
+            '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate={fps:g}:duration={duration:g}",
+            '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=44100:duration={duration:g}",
+            '-loop', '1', '-i', template_path,
+            '-filter_complex', filters, '-map', '[v]', '-map', '1:a',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest',
+            f"{path}.tmp.mp4"]
+    subprocess.run(args, check=True)
+    os.replace(f"{path}.tmp.mp4", path)
+
+
+def export_jobs(duration, segment_length):
+    """Two ranges away from the ends of the video."""
+    starts = [duration * 0.1, duration * 0.5]
+    return [{'start': round(start, 3), 'end': round(min(duration, start + segment_length), 3)} for start in starts]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its finished children, in MB."""
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {'self': round(self_kb / 1024, 1), 'children': round(children_kb / 1024, 1)}
+
+
+def run_analysis_stage(case):
+    from process_video import analyze_video_for_changes
+    from thumbnails import extract_thumbnails
+
+    video_path, fps, duration = case['video'], case['fps'], case['duration']
+    expected_time = case['expected_frame'] / fps
+    decoded_frames = {}
+    start = time.perf_counter()
+    found = analyze_video_for_changes(video_path, sensitivity=case['sensitivity'],
+                                      sample_interval=case['sample_interval'], decoded_frames=decoded_frames)
+    elapsed = time.perf_counter() - start
+    covered_seconds = found[0]['time'] if found else duration
+    result = {
+        'time_to_first_match': round(elapsed, 3),
+        'found_time': round(found[0]['time'], 3) if found else None,
+        'expected_time': round(expected_time, 3),
+        'error_seconds': round(found[0]['time'] - expected_time, 3) if found else None,
+        'error_frames': int(round((found[0]['time'] - expected_time) * fps)) if found else None,
+        'good_matches': found[0]['good_matches'] if found else None,
+        'frames_per_second': round(covered_seconds * fps / elapsed, 1),
+        'realtime_factor': round(covered_seconds / elapsed, 2),
+    }
+
+    if case['full_scan']:
+        start = time.perf_counter()
+        analyze_video_for_changes(video_path, sensitivity=case['sensitivity'],
+                                  sample_interval=case['sample_interval'], full_scan=True)
+        elapsed = time.perf_counter() - start
+        result['full_scan'] = {'seconds': round(elapsed, 3), 'frames_per_second': round(duration * fps / elapsed, 1)}
+
+    thumbnail_dir = os.path.join(case['output_dir'], 'thumbnails')
+    shutil.rmtree(thumbnail_dir, ignore_errors=True)
+    times = [job['start'] for job in case['jobs']]
+    if found:
+        times.append(found[0]['time'])
+    start = time.perf_counter()
+    thumbnails = extract_thumbnails(video_path, times, thumbnail_dir, decoded_frames=decoded_frames)
+    result['thumbnails'] = {'count': sum(1 for url in thumbnails if url),
+                            'seconds': round(time.perf_counter() - start, 3)}
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_export_stage(case):
+    from export_planner import plan_concat_export, plan_segment_exports
+    from segment_cutting import cut_video, run_ffmpeg
+
+    video_path, jobs = case['video'], case['jobs']
+    output_dir = os.path.join(case['output_dir'], 'exports')
+    os.makedirs(output_dir, exist_ok=True)
+    exported_seconds = sum(job['end'] - job['start'] for job in jobs)
+    results = {}
+    for cut_mode in case['cut_modes']:
+        for fmt in case['formats']:
+            format_jobs = [dict(job, formats=[fmt]) for job in jobs]
+
+            # Per-segment files, as export_segment writes them.
+            start = time.perf_counter()
+            for step in plan_segment_exports(video_path, format_jobs, output_dir, True, cut_mode):
+                if step['video_cut']:
+                    cut_video(video_path, step['start'], step['end'], step['outputs']['mp4'], step['video_cut'])
+                if step['ffmpeg_args']:
+                    run_ffmpeg(step['ffmpeg_args'])
+            segments_elapsed = time.perf_counter() - start
+
+            # One combined file, as process_and_concatenate_segments writes it.
+            start = time.perf_counter()
+            plan = plan_concat_export(video_path, format_jobs, output_dir, True, cut_mode)
+            if plan['ffmpeg_args']:
+                run_ffmpeg(plan['ffmpeg_args'], plan['stdin'])
+            concat_elapsed = time.perf_counter() - start
+
+            results[f"{cut_mode}/{fmt}"] = {
+                'segments_seconds': round(segments_elapsed, 3),
+                'segments_realtime_factor': round(exported_seconds / segments_elapsed, 2),
+                'concat_seconds': round(concat_elapsed, 3),
+                'concat_realtime_factor': round(exported_seconds / concat_elapsed, 2),
+            }
+            shutil.rmtree(output_dir, ignore_errors=True)
+            os.makedirs(output_dir, exist_ok=True)
+    return {'exported_seconds': round(exported_seconds, 3), 'formats': results, 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_stage(stage, case, work_dir):
+    """Runs one stage of one case in a fresh interpreter and returns its result."""
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--stage', stage, json.dumps(case)],
+                            cwd=work_dir, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def parse_list(text, cast):
+    return [cast(item) for item in text.split(',') if item]
+
+
+def git_commit():
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolutions', default='640x360,1280x720,1920x1080')
+    parser.add_argument('--durations', default='120', help='seconds, comma separated')
+    parser.add_argument('--fps', default='30', help='comma separated')
+    parser.add_argument('--template', default=os.path.join(REPO_DIR, 'template.jpg'))
+    parser.add_argument('--sensitivity', type=int, default=80)
+    parser.add_argument('--sample-interval', type=float, default=1.0)
+    parser.add_argument('--full-scan', action='store_true', help='also time scoring the whole video')
+    parser.add_argument('--formats', default='mp4,mp3')
+    parser.add_argument('--cut-modes', default='exact', help="'copy' and 'smart' need ffprobe")
+    parser.add_argument('--segment-length', type=float, default=10.0)
+    parser.add_argument('--skip-export', action='store_true')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'quick-edit-bench'))
+    parser.add_argument('--output', default=None, help='JSON results file (default: bench-pipeline-<time>.json)')
+    parser.add_argument('--stage', nargs=2, metavar=('STAGE', 'CASE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        stage, case = args.stage[0], json.loads(args.stage[1])
+        result = run_analysis_stage(case) if stage == 'analysis' else run_export_stage(case)
+        print(json.dumps(result))
+        return 0
+
+    if not os.path.exists(args.template):
+        print(f"Template not found: {args.template}")
+        return 1
+    # The stages run in --work-dir, so the registry there holds only this template.
+    os.makedirs(args.work_dir, exist_ok=True)
+    shutil.copyfile(args.template, os.path.join(args.work_dir, 'template.jpg'))
+    output_path = args.output or f"bench-pipeline-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+
+    cases = []
+    for resolution, duration, fps in itertools.product(parse_list(args.resolutions, str),
+                                                       parse_list(args.durations, float),
+                                                       parse_list(args.fps, float)):
+        width, height = (int(value) for value in resolution.lower().split('x'))
+        video_path = os.path.join(args.work_dir, video_name(width, height, duration, fps))
+        if not os.path.exists(video_path):
+            print(f"Generating {os.path.basename(video_path)}...")
+            generate_video(video_path, args.template, width, height, duration, fps)
+
+        case = {
+            'video': video_path, 'width': width, 'height': height, 'duration': duration, 'fps': fps,
+            'expected_frame': expected_match_frame(duration, fps),
+            'sensitivity': args.sensitivity, 'sample_interval': args.sample_interval, 'full_scan': args.full_scan,
+            'jobs': export_jobs(duration, args.segment_length),
+            'formats': parse_list(args.formats, str), 'cut_modes': parse_list(args.cut_modes, str),
+            'output_dir': os.path.join(args.work_dir, 'out'),
+        }
+        print(f"{width}x{height} {duration:g}s {fps:g}fps:")
+        analysis = run_stage('analysis', case, args.work_dir)
+        if 'error' in analysis:
+            print(f"  analysis failed: {analysis['error']}")
+        else:
+            print(f"  first match {analysis['found_time']}s (expected {analysis['expected_time']}s, "
+                  f"{analysis['error_frames']} frame(s) off) in {analysis['time_to_first_match']:.2f}s, "
+                  f"{analysis['frames_per_second']:.0f} fps, peak RSS {analysis['peak_rss_mb']['self']:.0f} MB")
+        export = {} if args.skip_export else run_stage('export', case, args.work_dir)
+        if 'error' in export:
+            print(f"  export failed: {export['error']}")
+        for name, timing in export.get('formats', {}).items():
+            print(f"  export {name}: {timing['segments_realtime_factor']:.1f}x realtime per segment, "
+                  f"{timing['concat_realtime_factor']:.1f}x concatenated")
+        cases.append({'video': os.path.basename(video_path), 'width': width, 'height': height,
+                      'duration': duration, 'fps': fps, 'analysis': analysis, 'export': export})
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'environment': {name: os.environ.get(name) for name in ('ANALYSIS_THREADS', 'FFMPEG_THREADS')},
+        'settings': {key: value for key, value in vars(args).items() if key not in ('stage', 'output')},
+        'cases': cases,
+    }
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Recall check for the prefilter cascade (prefilters.py).
+
+Builds frames with the template pasted in at several sizes and positions over
+different backgrounds (plus the template stretched to the whole frame, and frames
+without it), at several resolutions, and scores each with and without the cascade:
+at full resolution against the sensitivity, and on the coarse pass's downscaled
+frames against its loosened threshold. Frames from --video files are added as they
+are. Fails if the cascade zeroes any frame the unfiltered matcher scores above the
+threshold, and reports how many of the other frames it spares ORB.
+
+    python benchmarks/bench_prefilter.py --sensitivity 70 --video some_stream.mp4
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from prefilters import PrefilterCascade
+from template_registry import load_registry
+from video_analysis import COARSE_THRESHOLD_RATIO, TemplateMatcher, coarse_scale, sample_frames
+
+RESOLUTIONS = ((1920, 1080), (1280, 720), (854, 480))
+TEMPLATE_SCALES = (1.3, 1.0, 0.8, 0.6, 0.45, 0.35, 0.3)
+
+
+def backgrounds(rng, width, height):
+    yield 'dark', np.full((height, width, 3), 20, dtype=np.uint8)
+    yield 'light', np.full((height, width, 3), 220, dtype=np.uint8)
+    blobs = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+    yield 'blobs', cv2.GaussianBlur(cv2.resize(blobs, (width, height)), (31, 31), 0)
+    ramp = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    yield 'gradient', cv2.merge([ramp, 255 - ramp, ramp // 2])
+    yield 'noise', rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+
+def synthetic_frames(template, rng, width, height):
+    """(name, frame) pairs: the template at every scale and position, full-frame, and absent."""
+    template_height, template_width = template.shape[:2]
+    for background_name, background in backgrounds(rng, width, height):
+        for scale in TEMPLATE_SCALES:
+            pasted = cv2.resize(template, (int(template_width * scale), int(template_height * scale)),
+                                interpolation=cv2.INTER_AREA)
+            paste_height, paste_width = pasted.shape[:2]
+            if paste_width > width or paste_height > height:
+                continue
+            for x, y in ((0, 0), ((width - paste_width) // 2, (height - paste_height) // 2),
+                         (width - paste_width, height - paste_height)):
+                frame = background.copy()
+                frame[y:y + paste_height, x:x + paste_width] = pasted
+                yield f"{width}x{height} {background_name} template x{scale} at {x},{y}", frame
+        yield f"{width}x{height} {background_name} full-frame", cv2.resize(template, (width, height))
+        yield f"{width}x{height} {background_name} no template", background
+
+
+def video_frames(video_path, sample_interval):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        for frame_index, timestamp, frame in sample_frames(cap, sample_interval):
+            yield f"{os.path.basename(video_path)} {timestamp:.1f}s", frame
+    finally:
+        cap.release()
+
+
+def coarse_matchers(registry, prefilter, width):
+    """The coarse pass's matchers for frames `width` wide, with and without the cascade."""
+    scale = coarse_scale(width)
+    return TemplateMatcher(registry, scale), TemplateMatcher(registry, scale, prefilter)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensitivity', type=int, default=70, help='the loosest the upload form allows')
+    parser.add_argument('--video', action='append', default=[], help='also check frames sampled from this video')
+    parser.add_argument('--sample-interval', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    registry = load_registry()
+    template = cv2.imread(registry.paths[0])
+    rng = np.random.default_rng(args.seed)
+    prefilter = PrefilterCascade(registry.paths)
+    full_plain, full_filtered = TemplateMatcher(registry), TemplateMatcher(registry, prefilter=prefilter)
+    coarse_threshold = args.sensitivity * COARSE_THRESHOLD_RATIO
+
+    frames = [frame for width, height in RESOLUTIONS for frame in synthetic_frames(template, rng, width, height)]
+    for video_path in args.video:
+        frames.extend(video_frames(video_path, args.sample_interval))
+
+    misses = []
+    positives = negatives = spared = 0
+    plain_seconds = filtered_seconds = 0.0
+    coarse = {}
+    for name, frame in frames:
+        width = frame.shape[1]
+        if width not in coarse:
+            coarse[width] = coarse_matchers(registry, prefilter, width)
+        for label, (plain, filtered), threshold in (('full', (full_plain, full_filtered), args.sensitivity),
+                                                    ('coarse', coarse[width], coarse_threshold)):
+            started = time.perf_counter()
+            expected = plain.match_counts(frame)
+            plain_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            counts = filtered.match_counts(frame)
+            filtered_seconds += time.perf_counter() - started
+
+            for template_index in np.flatnonzero(expected > threshold):
+                if counts[template_index] <= threshold:
+                    misses.append(f"{name} ({label}): {int(expected[template_index])} good matches without the "
+                                  f"cascade, {int(counts[template_index])} with it")
+            if (expected > threshold).any():
+                positives += 1
+            else:
+                negatives += 1
+                spared += int(not counts.any())
+
+    stats = prefilter.stats()
+    print(f"{len(frames)} frames, {positives} matcher checks above threshold, {negatives} below.")
+    print(f"Cascade rejected {stats['checked'] - stats['passed']} of {stats['checked']} checks: {stats['rejected']}")
+    print(f"Spared ORB on {spared} of {negatives} non-matching checks; "
+          f"matching took {filtered_seconds:.2f}s with the cascade, {plain_seconds:.2f}s without.")
+    if misses:
+        print(f"FAIL: the cascade dropped {len(misses)} real match(es):")
+        for miss in misses:
+            print(f"  {miss}")
+        return 1
+    print("OK: no real match dropped.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
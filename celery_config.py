@@ -1,16 +1,57 @@
+import os
 from celery import Celery
+from channel_listing import CHANNEL_LISTING_REFRESH
+
+# With late acks, Redis hands a task that hasn't been acknowledged within this many
+# seconds to another worker. It has to outlast the longest task (a full-length
+# Whisper transcription or encode of a multi-hour stream), or that task runs twice.
+BROKER_VISIBILITY_TIMEOUT = int(os.environ.get('BROKER_VISIBILITY_TIMEOUT', 12 * 3600))
 
 # This is the single source of truth for the Celery application
 celery = Celery(
     'tasks',
     broker='redis://redis:6379/0',
-    backend='redis://redis:6379/0'
+    backend='redis://redis:6379/0',
+    # Only workers import the task modules. The web process sends tasks by name
+    # (celery.send_task), so it never loads OpenCV, NumPy or Whisper.
+    include=['process_video'],
 )
 
+# Analysis is interactive and short, encodes are CPU-bound batch work and Whisper is
+# slow and memory-hungry, so each gets its own queue (and its own workers in
+# docker-compose.yml). Priority decides order for a worker consuming several queues:
+# with Redis, 0 is served first.
+ANALYSIS_QUEUE = 'analysis'
+ENCODE_QUEUE = 'encode'
+TRANSCRIBE_QUEUE = 'transcribe'
+
 celery.conf.update(
     task_track_started=True,
-    broker_connection_retry_on_startup=True
+    broker_connection_retry_on_startup=True,
+    task_default_queue=ANALYSIS_QUEUE,
+    task_routes={
+        'process_video.start_analysis_task': {'queue': ANALYSIS_QUEUE, 'priority': 0},
+        'process_video.process_video_segments': {'queue': ENCODE_QUEUE, 'priority': 3},
+        'process_video.process_and_concatenate_segments': {'queue': ENCODE_QUEUE, 'priority': 3},
+        'process_video.export_segment': {'queue': ENCODE_QUEUE, 'priority': 5},
+        'process_video.collect_segment_exports': {'queue': ENCODE_QUEUE, 'priority': 2},
+        'process_video.transcribe_ranges': {'queue': TRANSCRIBE_QUEUE, 'priority': 7},
+        'process_video.refresh_channel_listing': {'queue': ANALYSIS_QUEUE, 'priority': 1},
+    },
+    # Run by the beat service in docker-compose.yml.
+    beat_schedule={
+        'refresh-channel-listing': {
+            'task': 'process_video.refresh_channel_listing',
+            'schedule': CHANNEL_LISTING_REFRESH,
+        },
+    },
+    task_queue_max_priority=10,
+    task_default_priority=5,
+    broker_transport_options={'priority_steps': list(range(10)), 'sep': ':', 'queue_order_strategy': 'priority',
+                              'visibility_timeout': BROKER_VISIBILITY_TIMEOUT},
+    result_backend_transport_options={'visibility_timeout': BROKER_VISIBILITY_TIMEOUT},
+    # Tasks run for minutes: take one at a time so queued work stays with the broker
+    # (and can go to an idle worker) rather than sitting in a busy worker's prefetch.
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
 )
-
-# --- FIX: Explicitly import the module that contains your tasks ---
-import process_video
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import time
+
+CHANNEL_URL_FILE = os.path.join('config', 'channel_url.txt')
+
+# How many of the channel's latest completed streams the index page lists.
+LATEST_VIDEOS_COUNT = 3
+
+# A listing older than this many seconds is still shown, but flagged as stale and
+# refreshed in the background. The beat task refreshes every CHANNEL_LISTING_REFRESH
+# seconds, so with the defaults a running beat keeps the page fresh.
+CHANNEL_LISTING_TTL = int(os.environ.get('CHANNEL_LISTING_TTL', 900))
+CHANNEL_LISTING_REFRESH = int(os.environ.get('CHANNEL_LISTING_REFRESH', 600))
+# Redis drops a listing nobody has refreshed for this long.
+CHANNEL_LISTING_MAX_AGE = 7 * 24 * 3600
+
+CHANNEL_LISTING_KEY = 'channel-listing:{}'
+# Held while a refresh is queued or running, so page views don't queue one each.
+CHANNEL_REFRESH_LOCK_KEY = 'channel-listing-refresh:{}'
+CHANNEL_REFRESH_LOCK_TTL = 120
+
+
+def read_channel_url():
+    if os.path.exists(CHANNEL_URL_FILE):
+        with open(CHANNEL_URL_FILE, 'r') as f:
+            return f.read().strip()
+    return ""
+
+
+def save_channel_url(channel_url):
+    with open(CHANNEL_URL_FILE, 'w') as f:
+        f.write(channel_url)
+
+
+def _channel_id(channel_url):
+    return hashlib.sha1(channel_url.strip().encode('utf-8')).hexdigest()[:16]
+
+
+def fetch_latest_videos(channel_url, count=LATEST_VIDEOS_COUNT):
+    """
+    The channel's latest completed live streams from its /streams page, newest first:
+    [{'title', 'url', 'thumbnail'}]. Entries without a duration (still live or
+    upcoming) are skipped.
+    """
+    import yt_dlp
+
+    print(f"Fetching latest videos from channel's /streams endpoint: {channel_url}")
+    ydl_opts = {
+        'playlistend': 5,
+        'quiet': True,
+        'ignoreerrors': True,
+    }
+    latest_videos = []
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        result = ydl.extract_info(f"{channel_url}/streams", download=False)
+    if result is None:
+        raise RuntimeError("yt-dlp returned no information for the channel.")
+    for entry in result.get('entries') or []:
+        if entry and entry.get('duration'):
+            latest_videos.append({
+                'title': entry.get('title'),
+                'url': entry.get('original_url') or f"https://www.youtube.com/watch?v={entry.get('id')}",
+                'thumbnail': entry.get('thumbnail')
+            })
+        if len(latest_videos) == count:
+            break
+    return latest_videos
+
+
+def read_listing(client, channel_url):
+    """
+    The cached listing for `channel_url` as {'videos', 'fetched_at', 'error', 'age',
+    'stale'} (age in seconds), or None when there is none yet.
+    """
+    data = client.get(CHANNEL_LISTING_KEY.format(_channel_id(channel_url)))
+    if data is None:
+        return None
+    listing = json.loads(data)
+    listing['age'] = time.time() - listing['fetched_at']
+    listing['stale'] = listing['age'] > CHANNEL_LISTING_TTL
+    return listing
+
+
+def write_listing(client, channel_url, videos, error=None):
+    listing = {'videos': videos, 'fetched_at': time.time(), 'error': error}
+    client.set(CHANNEL_LISTING_KEY.format(_channel_id(channel_url)), json.dumps(listing), ex=CHANNEL_LISTING_MAX_AGE)
+    client.delete(CHANNEL_REFRESH_LOCK_KEY.format(_channel_id(channel_url)))
+    return listing
+
+
+def invalidate_listing(client, channel_url):
+    client.delete(CHANNEL_LISTING_KEY.format(_channel_id(channel_url)),
+                  CHANNEL_REFRESH_LOCK_KEY.format(_channel_id(channel_url)))
+
+
+def claim_refresh(client, channel_url):
+    """True if the caller should queue a refresh, i.e. none is queued or running already."""
+    return bool(client.set(CHANNEL_REFRESH_LOCK_KEY.format(_channel_id(channel_url)), 1,
+                           nx=True, ex=CHANNEL_REFRESH_LOCK_TTL))
@@ -0,0 +1,27 @@
+import cv2
+import numpy as np
+
+# Lowe's ratio test: the nearest neighbour has to be clearly closer than the second.
+RATIO_TEST = 0.75
+
+
+def nearest_two(des_query, des_train):
+    """
+    Hamming distances from every query descriptor to its two nearest train descriptors,
+    as an (n_query, 2) int32 array. Same brute-force search BFMatcher.knnMatch(k=2)
+    does, without building a DMatch object per pair.
+    """
+    dist, nidx = cv2.batchDistance(des_query, des_train, cv2.CV_32S, normType=cv2.NORM_HAMMING, K=2)
+    return dist
+
+
+def count_ratio_matches(des_query, labels, n_labels, des_train):
+    """
+    Number of query descriptors passing the ratio test against `des_train`, tallied per
+    label. Frames with fewer than two descriptors can't pass it, as with knnMatch.
+    """
+    if des_train is None or len(des_train) < 2:
+        return np.zeros(n_labels, dtype=np.int32)
+    dist = nearest_two(des_query, des_train)
+    good = dist[:, 0] < RATIO_TEST * dist[:, 1]
+    return np.bincount(labels[good], minlength=n_labels).astype(np.int32)
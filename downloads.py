@@ -0,0 +1,73 @@
+import os
+import threading
+import yt_dlp
+
+FULL_FORMAT = 'best[ext=mp4]/best'
+
+# Height of the low-resolution stream analyzed while the full-quality file is still
+# downloading. 0 turns the proxy off: analysis then waits for the full download.
+ANALYSIS_PROXY_HEIGHT = int(os.environ.get('ANALYSIS_PROXY_HEIGHT', 360))
+
+
+def download_proxy(url, output_dir, max_height=ANALYSIS_PROXY_HEIGHT):
+    """
+    Downloads the video-only stream no taller than `max_height` (audio is no use to the
+    template search) and returns its path, or None when the site doesn't offer one.
+    """
+    ydl_opts = {
+        'format': f'bestvideo[height<={max_height}][ext=mp4]/bestvideo[height<={max_height}]/best[height<={max_height}]',
+        'outtmpl': os.path.join(output_dir, 'proxy.%(ext)s'),
+        'quiet': True,
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info_dict = ydl.extract_info(url, download=True)
+            return ydl.prepare_filename(info_dict)
+    except yt_dlp.utils.DownloadError as e:
+        print(f"No analysis proxy available: {e}")
+        return None
+
+
+class BackgroundDownload:
+    """
+    Full-quality download running on a thread. The metadata is fetched up front, so
+    the final `path` and the video's `width`/`height` are known straight away; wait()
+    blocks until the file is complete and re-raises any download error.
+    """
+
+    def __init__(self, url, output_dir):
+        self.ydl_opts = {'format': FULL_FORMAT, 'outtmpl': os.path.join(output_dir, '%(title)s.%(ext)s'),
+                         'progress_hooks': [self._on_progress]}
+        with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
+            self.info = ydl.extract_info(url, download=False)
+            self.path = ydl.prepare_filename(self.info)
+        self.width = self.info.get('width')
+        self.height = self.info.get('height')
+        self.percent = 0
+        self.error = None
+        self._thread = threading.Thread(target=self._run, daemon=True, name='full-download')
+
+    def _on_progress(self, status):
+        total = status.get('total_bytes') or status.get('total_bytes_estimate')
+        if total:
+            self.percent = int(status.get('downloaded_bytes', 0) * 100 / total)
+
+    def _run(self):
+        try:
+            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
+                ydl.process_ie_result(self.info, download=True)
+        except Exception as e:
+            self.error = e
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """True once the download has finished; False if `timeout` ran out first."""
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
@@ -0,0 +1,171 @@
+import os
+import numpy as np
+from media_probe import keyframe_times
+from segment_cutting import DEFAULT_CUT_MODE, copy_start, thread_args
+
+# Whisper's native input: 16 kHz mono, sent over the pipe as signed 16-bit PCM.
+WHISPER_SAMPLE_RATE = 16000
+
+
+def segment_name(base_name, start_time):
+    return f"{base_name}_segment_at_{int(start_time)}s"
+
+
+def plan_segment_exports(video_path, jobs, output_dir, has_audio, cut_mode=DEFAULT_CUT_MODE):
+    """
+    Turns the job list into one export step per distinct time range (jobs sharing a
+    range have their formats merged). Each step holds:
+
+      - 'ffmpeg_args': a single ffmpeg invocation that reads the range once and writes
+        both the re-encoded MP4 (exact cuts) and the MP3. Audio-only steps map only the
+        audio stream, so the video is never decoded. None when nothing is left.
+      - 'video_cut': set when the MP4 needs cut_video() instead ('copy' and 'smart' cuts
+        don't decode the bulk of the range, so they can't share the decode).
+      - 'outputs': {format: path} for every file the step produces.
+      - 'transcribe': True when the range also needs a transcript, written to
+        outputs['txt'] by a separate Whisper task (see transcription_args).
+    Source without audio gets no mp3/txt outputs.
+    """
+    ranges = {}
+    for job in jobs:
+        if job['end'] > job['start']:
+            ranges.setdefault((job['start'], job['end']), set()).update(job['formats'])
+
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    steps = []
+    for (start_time, end_time), formats in ranges.items():
+        name = segment_name(base_name, start_time)
+        outputs = {}
+        output_args = []
+        video_cut = None
+        transcribe = False
+
+        if 'mp4' in formats:
+            outputs['mp4'] = os.path.join(output_dir, f"{name}.mp4")
+            if cut_mode == 'exact':
+                output_args += ['-map', '0:v:0', '-map', '0:a:0?', '-c:v', 'libx264'] + thread_args()
+                output_args += ['-c:a', 'aac', outputs['mp4']]
+            else:
+                video_cut = cut_mode
+
+        if has_audio and 'mp3' in formats:
+            outputs['mp3'] = os.path.join(output_dir, f"{name}.mp3")
+            output_args += ['-map', '0:a:0', '-vn', '-q:a', '0', outputs['mp3']]
+
+        if has_audio and 'txt' in formats:
+            outputs['txt'] = os.path.join(output_dir, f"{name}.txt")
+            transcribe = True
+
+        ffmpeg_args = None
+        if output_args:
+            # -ss/-t as input options bound the read for every output at once.
+            ffmpeg_args = ['-ss', f'{start_time}', '-t', f'{end_time - start_time}', '-i', video_path] + output_args
+
+        steps.append({
+            'start': start_time,
+            'end': end_time,
+            'ffmpeg_args': ffmpeg_args,
+            'video_cut': video_cut,
+            'outputs': outputs,
+            'transcribe': transcribe,
+        })
+    return steps
+
+
+def _pcm_output(stream):
+    return ['-map', stream, '-ac', '1', '-ar', str(WHISPER_SAMPLE_RATE), '-f', 's16le', 'pipe:1']
+
+
+def _concat_list(video_path, ranges):
+    """ffconcat script reading each range of the source in place (fed to ffmpeg on stdin)."""
+    # Spelled as a file: URL, otherwise ffmpeg resolves it relative to the pipe: input.
+    quoted = 'file:' + os.path.abspath(video_path).replace("'", "'\\''")
+    lines = ['ffconcat version 1.0']
+    for start_time, end_time in ranges:
+        lines += [f"file '{quoted}'", f"inpoint {start_time}", f"outpoint {end_time}"]
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def plan_concat_export(video_path, jobs, output_dir, has_audio, cut_mode=DEFAULT_CUT_MODE):
+    """
+    Plans the combined outputs of a concatenation job as a single ffmpeg run straight
+    from the source, with no intermediate segment files. Only the requested formats
+    are written, and without an MP4 the video is never decoded.
+
+      - 'exact' (and 'smart', which would need temp parts to splice) opens the source
+        once per range with an input seek and joins them with the concat filter, so only
+        the selected ranges are decoded and everything is frame-accurate.
+      - 'copy' snaps each range start to a keyframe (see copy_start) and stream-copies
+        all of them through the concat demuxer, whose script goes to ffmpeg on stdin.
+        If any range has no keyframe to start from, the whole job is cut 'exact'.
+
+    Returns {'ffmpeg_args', 'stdin', 'outputs', 'transcribe', 'cuts'} shaped like the
+    steps from plan_segment_exports, with 'cuts' holding the cut made for each range.
+    """
+    ranges = [(job['start'], job['end']) for job in jobs if job['end'] > job['start']]
+    formats = set(fmt for job in jobs for fmt in job['formats'])
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    outputs = {}
+    for fmt in ('mp4', 'mp3', 'txt'):
+        if fmt in formats and (fmt == 'mp4' or has_audio):
+            outputs[fmt] = os.path.join(output_dir, f"{base_name}_combined.{fmt}")
+    plan = {'ffmpeg_args': None, 'stdin': None, 'outputs': outputs, 'transcribe': 'txt' in outputs, 'cuts': []}
+    keyframes = keyframe_times(video_path) if cut_mode == 'copy' and 'mp4' in outputs else []
+    copy_starts = [copy_start(keyframes, start_time, end_time) for start_time, end_time in ranges]
+
+    if keyframes and None not in copy_starts:
+        ranges = [(snapped_start, end_time) for snapped_start, (_, end_time) in zip(copy_starts, ranges)]
+        plan['cuts'] = [{'mode': 'copy', 'start': start_time, 'end': end_time} for start_time, end_time in ranges]
+        plan['stdin'] = _concat_list(video_path, ranges)
+        args = ['-f', 'concat', '-safe', '0', '-protocol_whitelist', 'file,pipe', '-i', 'pipe:0',
+                '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', outputs['mp4']]
+        if 'mp3' in outputs:
+            args += ['-map', '0:a:0', '-vn', '-q:a', '0', outputs['mp3']]
+        plan['ffmpeg_args'] = args
+        return plan
+
+    plan['cuts'] = [{'mode': 'exact', 'start': start_time, 'end': end_time} for start_time, end_time in ranges]
+    with_video = 'mp4' in outputs
+    audio_sinks = [fmt for fmt in ('mp4', 'mp3') if fmt in outputs and has_audio]
+    if not ranges or not (with_video or audio_sinks):
+        return plan
+
+    args = []
+    streams = ''
+    for i, (start_time, end_time) in enumerate(ranges):
+        args += ['-ss', f'{start_time}', '-t', f'{end_time - start_time}', '-i', video_path]
+        streams += (f'[{i}:v:0]' if with_video else '') + (f'[{i}:a:0]' if audio_sinks else '')
+    graph = f"{streams}concat=n={len(ranges)}:v={int(with_video)}:a={int(bool(audio_sinks))}"
+    graph += ('[v]' if with_video else '') + ('[a]' if audio_sinks else '')
+    audio_labels = {fmt: '[a]' for fmt in audio_sinks}
+    if len(audio_sinks) > 1:
+        audio_labels = {fmt: f'[a{i}]' for i, fmt in enumerate(audio_sinks)}
+        graph += f";[a]asplit={len(audio_sinks)}" + ''.join(audio_labels.values())
+    args += ['-filter_complex', graph]
+
+    if with_video:
+        args += ['-map', '[v]'] + (['-map', audio_labels['mp4']] if 'mp4' in audio_labels else [])
+        args += ['-c:v', 'libx264'] + thread_args() + ['-c:a', 'aac', outputs['mp4']]
+    if 'mp3' in audio_labels:
+        args += ['-map', audio_labels['mp3'], '-q:a', '0', outputs['mp3']]
+    plan['ffmpeg_args'] = args
+    return plan
+
+
+def transcription_args(video_path, ranges):
+    """
+    Audio-only ffmpeg run piping the given ranges, joined in order, to stdout as 16 kHz
+    PCM for Whisper. Transcription always runs apart from the encode, from this.
+    """
+    args = []
+    for start_time, end_time in ranges:
+        args += ['-ss', f'{start_time}', '-t', f'{end_time - start_time}', '-i', video_path]
+    if len(ranges) == 1:
+        return args + ['-vn'] + _pcm_output('0:a:0')
+    streams = ''.join(f'[{i}:a:0]' for i in range(len(ranges)))
+    return args + ['-filter_complex', f"{streams}concat=n={len(ranges)}:v=0:a=1[a]"] + _pcm_output('[a]')
+
+
+def pcm_to_float(pcm_bytes):
+    """Raw s16le PCM from the pipe as the float32 array Whisper accepts in place of a path."""
+    return np.frombuffer(pcm_bytes, dtype=np.int16).astype(np.float32) / 32768.0
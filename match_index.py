@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import numpy as np
+from video_analysis import score_samples
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+_file_hashes = {}
+
+
+def hash_file(path):
+    """SHA-256 of a file's contents, remembered per (path, size, mtime) for this process."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def index_key(video_hash, template_hash, **settings):
+    """
+    Index files are keyed by the video and template contents plus every setting
+    that changes the stored scores (sampling interval, coarse width, prefilters...).
+    The video is named by its AnalysisCache source key where it has one, so the index
+    is found before a download finishes, and by hash_file() otherwise.
+    """
+    payload = json.dumps({'video': video_hash, 'template': template_hash, 'settings': settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+class MatchScoreIndex:
+    """
+    Good-match counts for every sampled frame of one video (one column per template),
+    so any sensitivity can be answered without decoding the video again. Counts are
+    compared against sensitivity * threshold_ratio; build_index() scores at full
+    resolution, where the ratio is 1.
+    """
+
+    def __init__(self, fps, step, frame_indices, counts, threshold_ratio=1.0, template_names=()):
+        self.fps = float(fps)
+        self.step = int(step)
+        self.frame_indices = np.asarray(frame_indices, dtype=np.uint32)
+        counts = np.asarray(counts).reshape(len(self.frame_indices), -1)
+        self.counts = np.minimum(counts, np.iinfo(np.uint16).max).astype(np.uint16)
+        self.threshold_ratio = float(threshold_ratio)
+        self.template_names = [str(name) for name in template_names]
+
+    def above(self, sensitivity):
+        """True for samples where any template clears the threshold."""
+        return (self.counts > sensitivity * self.threshold_ratio).any(axis=1)
+
+    def candidate_runs(self, sensitivity):
+        """
+        Frame indices of samples above the threshold, grouped into runs of consecutive
+        samples; each run is one separate appearance of the template.
+        """
+        above = np.flatnonzero(self.above(sensitivity))
+        if len(above) == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(above) > 1) + 1
+        return [self.frame_indices[run].tolist() for run in np.split(above, breaks)]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp.npz"
+        np.savez_compressed(temp_path, fps=self.fps, step=self.step, frame_indices=self.frame_indices,
+                            counts=self.counts, threshold_ratio=self.threshold_ratio,
+                            template_names=np.array(self.template_names, dtype=str))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return cls(data['fps'], data['step'], data['frame_indices'], data['counts'],
+                           data['threshold_ratio'], data['template_names'].tolist())
+        except Exception as e:
+            print(f"Ignoring unreadable match index {path}: {e}")
+            return None
+
+
+def build_index(video_path, matcher, sample_interval=1.0, strategy='auto', shards=None):
+    """
+    Scores every sample of the video at full resolution and returns the resulting
+    MatchScoreIndex. The coarse pass would be cheaper, but it can't see a card shown
+    small, and the index has to answer every sensitivity.
+    """
+    scored = score_samples(video_path, matcher, sample_interval, strategy, shards)
+    if scored is None:
+        return None
+    fps, frame_indices, counts = scored
+    step = max(1, int(round(sample_interval * fps)))
+    return MatchScoreIndex(fps, step, frame_indices, counts, 1.0, matcher.names)
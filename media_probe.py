@@ -0,0 +1,135 @@
+import json
+import os
+import subprocess
+
+# keyframe_interval() measures the keyframe spacing over this many seconds from the start.
+KEYFRAME_PROBE_SECONDS = 60
+
+# Probe results per file, in this process and in a sidecar next to the video so the
+# other workers handling later stages of the same job don't run ffprobe again.
+_probes = {}
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime
+
+
+def _ffprobe(args):
+    result = subprocess.run(['ffprobe', '-v', 'error'] + args, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe exited with {result.returncode}: {result.stderr.strip()}")
+    return result.stdout
+
+
+def _sidecar_path(video_path):
+    return f"{video_path}.probe.json"
+
+
+def _cached(video_path):
+    """The probe record for the file as it is now: {'metadata': ..., 'keyframes': ...}."""
+    key = _file_key(video_path)
+    if key not in _probes:
+        record = {}
+        try:
+            with open(_sidecar_path(video_path), 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored.get('size') == key[1] and stored.get('mtime') == key[2]:
+                record = stored
+        except (OSError, ValueError):
+            pass
+        _probes[key] = record
+    return key, _probes[key]
+
+
+def _store(video_path, key, record):
+    record.update({'size': key[1], 'mtime': key[2]})
+    _probes[key] = record
+    temp_path = f"{_sidecar_path(video_path)}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(temp_path, _sidecar_path(video_path))
+    except OSError as e:
+        print(f"Could not save probe sidecar for {video_path}: {e}")
+
+
+def _frame_rate(rate):
+    numerator, _, denominator = (rate or '0/0').partition('/')
+    try:
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def probe(video_path):
+    """
+    Container metadata from a single ffprobe call that only reads headers:
+    {'duration', 'fps', 'width', 'height', 'video_codec', 'has_video', 'has_audio'}.
+    Nothing is decoded. Remembered per file (path, size and mtime).
+    """
+    key, record = _cached(video_path)
+    if 'metadata' not in record:
+        output = json.loads(_ffprobe(['-show_entries', 'format=duration:stream=codec_type,codec_name,width,height,'
+                                      'avg_frame_rate,r_frame_rate,duration', '-of', 'json', video_path]))
+        streams = output.get('streams', [])
+        video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+        duration = output.get('format', {}).get('duration') or (video or {}).get('duration') or 0
+        record = dict(record, metadata={
+            'duration': float(duration),
+            'fps': (_frame_rate(video.get('avg_frame_rate')) or _frame_rate(video.get('r_frame_rate'))) if video else 0.0,
+            'width': video.get('width') if video else None,
+            'height': video.get('height') if video else None,
+            'video_codec': video.get('codec_name') if video else None,
+            'has_video': video is not None,
+            'has_audio': any(s.get('codec_type') == 'audio' for s in streams),
+        })
+        _store(video_path, key, record)
+    return record['metadata']
+
+
+def keyframe_times(video_path):
+    """
+    Sorted presentation times (seconds) of the video stream's keyframes, taken from the
+    packet flags in the container so nothing is decoded. Remembered like probe().
+    """
+    key, record = _cached(video_path)
+    if 'keyframes' not in record:
+        output = _ffprobe(['-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+                           '-of', 'csv=p=0', video_path])
+        times = []
+        for line in output.splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                times.append(float(pts_time))
+        record = dict(record, keyframes=sorted(times))
+        _store(video_path, key, record)
+    return record['keyframes']
+
+
+def keyframe_interval(video_path, probe_seconds=KEYFRAME_PROBE_SECONDS):
+    """
+    Median seconds between the video stream's keyframes over its first `probe_seconds`,
+    or None if fewer than two keyframes turn up there. Only those packets are read, so
+    it's cheap on any length of video. Remembered like probe().
+    """
+    key, record = _cached(video_path)
+    if 'keyframe_interval' not in record:
+        output = _ffprobe(['-select_streams', 'v:0', '-read_intervals', f'%+{probe_seconds}',
+                           '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path])
+        times = sorted(float(pts_time) for pts_time, _, flags in (line.partition(',') for line in output.splitlines())
+                       if 'K' in flags and pts_time not in ('', 'N/A'))
+        intervals = sorted(b - a for a, b in zip(times, times[1:]))
+        record = dict(record, keyframe_interval=intervals[len(intervals) // 2] if intervals else None)
+        _store(video_path, key, record)
+    return record['keyframe_interval']
+
+
+def video_codec(video_path):
+    return probe(video_path)['video_codec']
+
+
+def remove_probe(video_path):
+    """Drops the sidecar of a file that is about to be deleted."""
+    if os.path.exists(_sidecar_path(video_path)):
+        os.remove(_sidecar_path(video_path))
@@ -0,0 +1,184 @@
+import cv2
+import numpy as np
+import threading
+
+# Frames are shrunk to this width once and every stage works on that copy.
+PREFILTER_WIDTH = 160
+
+# A template counts as a full-frame card when, at the video's resolution, it is
+# within this fraction of the frame's width and height.
+FULL_FRAME_TOLERANCE = 0.1
+
+# ORB still finds the template well below its captured size, so the template stage
+# tries sizes down to this many pixels wide at prefilter resolution (about a sixth
+# of the frame), where ORB has long stopped clearing any useful sensitivity.
+MIN_TEMPLATE_WIDTH = 24
+
+
+def is_full_frame(template_shape, small_frame, scale):
+    """
+    True if a template of `template_shape`, shown at its captured size, fills the
+    frame. `scale` maps template pixels to `small_frame` pixels.
+    """
+    height, width = template_shape[:2]
+    frame_height, frame_width = small_frame.shape[:2]
+    return (abs(width * scale - frame_width) <= FULL_FRAME_TOLERANCE * frame_width and
+            abs(height * scale - frame_height) <= FULL_FRAME_TOLERANCE * frame_height)
+
+
+class PerceptualHashFilter:
+    """
+    Rejects frames whose difference hash (dHash) is far from the template's.
+    A whole-frame hash says nothing about a template that covers only part of the
+    frame, so any other frame is accepted: the stage only judges full-frame cards.
+    """
+    name = 'phash'
+
+    def __init__(self, template_bgr, max_distance=22):
+        self.max_distance = max_distance
+        self.template_shape = template_bgr.shape
+        self.template_hash = self._dhash(template_bgr)
+
+    @staticmethod
+    def _dhash(image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        return (small[:, 1:] > small[:, :-1]).flatten()
+
+    def accepts(self, small_frame, scale):
+        if not is_full_frame(self.template_shape, small_frame, scale):
+            return True
+        distance = int((self._dhash(small_frame) != self.template_hash).sum())
+        return distance <= self.max_distance
+
+
+class HistogramFilter:
+    """
+    Rejects frames whose hue/saturation histogram doesn't correlate with the template's.
+    Like the dHash stage it only judges full-frame cards: a small template barely moves
+    the histogram of the frame around it.
+    """
+    name = 'histogram'
+
+    def __init__(self, template_bgr, min_correlation=0.2):
+        self.min_correlation = min_correlation
+        self.template_shape = template_bgr.shape
+        self.template_hist = self._hist(template_bgr)
+
+    @staticmethod
+    def _hist(image):
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1], None, [30, 32], [0, 180, 0, 256])
+        return cv2.normalize(hist, hist)
+
+    def accepts(self, small_frame, scale):
+        if not is_full_frame(self.template_shape, small_frame, scale):
+            return True
+        correlation = cv2.compareHist(self.template_hist, self._hist(small_frame), cv2.HISTCMP_CORREL)
+        return correlation >= self.min_correlation
+
+
+class DownscaledTemplateFilter:
+    """
+    Rejects frames where a downscaled matchTemplate never gets close to the template.
+    ORB matches the template at other sizes than it was captured at, so it is tried
+    over a ladder of sizes, from the largest that fits the frame down to
+    MIN_TEMPLATE_WIDTH, plus stretched to the whole frame for full-frame cards.
+    """
+    name = 'template'
+
+    def __init__(self, template_bgr, min_score=0.3, size_step=0.9, min_width=MIN_TEMPLATE_WIDTH):
+        self.min_score = min_score
+        self.size_step = size_step
+        self.min_width = min_width
+        self.template_gray = cv2.cvtColor(template_bgr, cv2.COLOR_BGR2GRAY)
+        self._scaled_templates = {}
+
+    def _templates_for(self, frame_gray):
+        key = frame_gray.shape
+        if key not in self._scaled_templates:
+            height, width = self.template_gray.shape
+            frame_height, frame_width = frame_gray.shape
+            sizes = [(frame_width, frame_height)]
+            factor = min(frame_width / width, frame_height / height)
+            while width * factor >= self.min_width:
+                sizes.append((max(1, int(width * factor)), max(1, int(height * factor))))
+                factor *= self.size_step
+            self._scaled_templates[key] = [cv2.resize(self.template_gray, size, interpolation=cv2.INTER_AREA)
+                                           for size in sizes]
+        return self._scaled_templates[key]
+
+    def accepts(self, small_frame, scale):
+        frame_gray = cv2.cvtColor(small_frame, cv2.COLOR_BGR2GRAY)
+        for template in self._templates_for(frame_gray):
+            scores = cv2.matchTemplate(frame_gray, template, cv2.TM_CCOEFF_NORMED)
+            if float(scores.max()) >= self.min_score:
+                return True
+        return False
+
+
+PREFILTER_STAGES = {
+    'phash': PerceptualHashFilter,
+    'histogram': HistogramFilter,
+    'template': DownscaledTemplateFilter,
+}
+
+DEFAULT_PREFILTERS = ('phash', 'histogram', 'template')
+
+
+class PrefilterCascade:
+    """
+    Runs cheap rejectors in order before ORB. Each stage drops the templates a frame
+    clearly can't match; once none are left the remaining stages (and ORB) are skipped.
+    Keeps a counter per stage of the frames it eliminated, so a run can be compared
+    with one that has the cascade disabled.
+    """
+
+    def __init__(self, template_paths, stages=DEFAULT_PREFILTERS, width=PREFILTER_WIDTH):
+        self.width = width
+        self.stage_names = list(stages)
+        self.template_stages = []
+        for template_path in template_paths:
+            template = cv2.imread(template_path)
+            if template is None:
+                raise FileNotFoundError(f"{template_path} not found or could not be read.")
+            self.template_stages.append([PREFILTER_STAGES[name](template) for name in stages])
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.passed = 0
+        self.rejected = {name: 0 for name in self.stage_names}
+
+    def surviving_templates(self, frame, reference_width=None):
+        """
+        Boolean mask, in template order, of the templates this frame might still match.
+        For a frame from a low-resolution proxy, `reference_width` is the width of the
+        full video, which is the resolution the templates were captured at.
+        """
+        height, width = frame.shape[:2]
+        frame_scale = min(1.0, self.width / width)
+        small_frame = cv2.resize(frame, (max(1, int(width * frame_scale)), max(1, int(height * frame_scale))),
+                                 interpolation=cv2.INTER_AREA)
+        # Maps template pixels to small_frame pixels.
+        scale = small_frame.shape[1] / reference_width if reference_width else frame_scale
+
+        surviving = np.ones(len(self.template_stages), dtype=bool)
+        rejected_by = None
+        for stage_index, name in enumerate(self.stage_names):
+            for template_index, stages in enumerate(self.template_stages):
+                if surviving[template_index] and not stages[stage_index].accepts(small_frame, scale):
+                    surviving[template_index] = False
+            if not surviving.any():
+                rejected_by = name
+                break
+
+        with self._lock:
+            self.checked += 1
+            if rejected_by is None:
+                self.passed += 1
+            else:
+                self.rejected[rejected_by] += 1
+        return surviving
+
+    def stats(self):
+        with self._lock:
+            return {'checked': self.checked, 'passed': self.passed, 'rejected': dict(self.rejected)}
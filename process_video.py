@@ -1,52 +1,176 @@
 import cv2
 import numpy as np
-from moviepy.editor import VideoFileClip
 import os
-import shutil
-import whisper
-import yt_dlp
+import time
+import whisper_pool
+from celery import chord, group
+from celery.signals import task_postrun, task_prerun, worker_process_init
 from celery_config import celery
+from prefilters import PrefilterCascade
+from thumbnails import extract_thumbnails
+from media_probe import probe, remove_probe
+from channel_listing import fetch_latest_videos, read_channel_url, read_listing, write_listing
+from analysis_cache import (ANALYSIS_CACHE_STATS_KEY, AnalysisCache, file_source_key, source_in_use, touch_source,
+                            url_source_key)
+from export_planner import pcm_to_float, plan_concat_export, plan_segment_exports, transcription_args
+from segment_cutting import DEFAULT_CUT_MODE, FFmpegError, cut_video, run_ffmpeg
+from task_metrics import add_counts, add_timing, merge_metrics, record_metrics, record_task_run, timed
+from template_registry import load_registry
+from transcripts import get_source_transcript, slice_transcript
+from match_index import MatchScoreIndex, build_index, hash_file, index_key
+from video_analysis import (ANALYSIS_THREADS, COARSE_MAX_WIDTH, TemplateMatcher, find_first_match_coarse_to_fine,
+                            refine_proxy_candidate)
 import traceback
 
+# --- Worker Lifecycle ---
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    if ANALYSIS_THREADS:
+        cv2.setNumThreads(ANALYSIS_THREADS)
+    whisper_pool.start()
+
+
+# Start time of each task running in this process, for its run time in /metrics.
+_task_started = {}
+
+
+@task_prerun.connect
+def start_task_clock(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task_clock(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is None or task is None:
+        return
+    try:
+        record_task_run(celery.backend.client, task.name, state or 'unknown', time.perf_counter() - started)
+    except Exception as e:
+        print(f"Could not record metrics for {task.name}: {e}")
+
+
+def _record_metrics(task, timings, counters):
+    try:
+        record_metrics(celery.backend.client, task.name, timings, counters)
+    except Exception as e:
+        print(f"Could not record metrics for {task.name}: {e}")
+
 # --- Celery Tasks ---
 
 @celery.task(bind=True)
-def start_analysis_task(self, sensitivity, thumbnail_dir, upload_dir, video_path=None, url=None, youtube_video_id=None):
+def start_analysis_task(self, sensitivity, thumbnail_dir, upload_dir, video_path=None, url=None, youtube_video_id=None, sample_interval=1.0, analysis_shards=None, use_prefilter=True,
+                        full_scan=False, all_occurrences=False):
     """
-    The main entry point task. Handles download and analysis, passing the video_id through.
+    The main entry point task. Handles download and analysis, passing the video_id through,
+    with sources and results going through the AnalysisCache. Seconds per stage and
+    counters come back under 'timings' and 'counters' and are added to /metrics.
     """
     try:
         original_url = url 
+        cache = AnalysisCache(upload_dir)
+        timings, counters = {}, {}
+
+        with timed(timings, 'cache_lookup'):
+            if url:
+                source_key = url_source_key(url, youtube_video_id)
+                video_path = cache.get_source(source_key)
+            else:
+                self.update_state(state='PROGRESS', meta={'status': 'Checking for a previous analysis...'})
+                source_key = file_source_key(video_path)
+                cached_path = cache.get_source(source_key)
+                if cached_path:
+                    os.remove(video_path)
+                    video_path = cached_path
+                else:
+                    video_path = cache.put_source(source_key, video_path)
+
+            analysis_key = cache.analysis_key(source_key, load_registry().fingerprint, sensitivity=sensitivity,
+                                              sample_interval=sample_interval, use_prefilter=use_prefilter,
+                                              full_scan=full_scan, all_occurrences=all_occurrences)
+            cached_result = cache.get_analysis(source_key, analysis_key) if video_path else None
+        celery.backend.client.hincrby(ANALYSIS_CACHE_STATS_KEY, 'hit' if cached_result else 'miss', 1)
+        if cached_result:
+            print(f"Analysis cache hit for {source_key}.")
+            cached_result.update({'original_url': original_url, 'youtube_video_id': youtube_video_id})
+            _record_metrics(self, timings, counters)
+            return {'status': 'Analysis Complete', 'result': cached_result, 'cache': 'hit',
+                    'timings': timings, 'counters': counters}
+
+        # A URL download runs in the background. If the site offers a low-resolution
+        # stream, that is fetched first and analyzed while the full file downloads;
+        # only refining the candidates needs the full file.
+        proxy = None
+        downloading = url and not video_path
+        if downloading:
+            # yt-dlp is imported on the first URL job only; encode and transcribe
+            # workers never need it.
+            from downloads import ANALYSIS_PROXY_HEIGHT, BackgroundDownload, download_proxy
+            self.update_state(state='PROGRESS', meta={'status': 'Downloading video...', 'percent': 0})
+            download_started = time.perf_counter()
+            download = BackgroundDownload(url, cache.source_dir(source_key)).start()
+            video_path = download.path
+
+            def wait_for_video():
+                while not download.wait(timeout=2):
+                    self.update_state(state='PROGRESS',
+                                      meta={'status': 'Waiting for the full-quality download...',
+                                            'percent': download.percent})
+                if 'download' not in timings:
+                    add_timing(timings, 'download', time.perf_counter() - download_started)
+                    add_counts(counters, bytes_downloaded=os.path.getsize(download.path))
 
-        if url:
-            self.update_state(state='PROGRESS', meta={'status': 'Downloading video...'})
-            ydl_opts = { 'format': 'best[ext=mp4]/best', 'outtmpl': os.path.join(upload_dir, '%(title)s.%(ext)s') }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info_dict = ydl.extract_info(url, download=True)
-                video_path = ydl.prepare_filename(info_dict)
+            if ANALYSIS_PROXY_HEIGHT and (download.height or 0) > ANALYSIS_PROXY_HEIGHT:
+                self.update_state(state='PROGRESS', meta={'status': 'Downloading low-resolution copy for analysis...'})
+                with timed(timings, 'proxy_download'):
+                    proxy_path = download_proxy(url, cache.source_dir(source_key))
+                if proxy_path and os.path.exists(proxy_path):
+                    add_counts(counters, bytes_downloaded=os.path.getsize(proxy_path))
+                    proxy = {'path': proxy_path, 'reference_width': download.width, 'wait_for_video': wait_for_video}
+            if proxy is None:
+                wait_for_video()
         
-        if not video_path or not os.path.exists(video_path):
+        if proxy is None and (not video_path or not os.path.exists(video_path)):
             raise FileNotFoundError("Video file not found after download/upload.")
 
         self.update_state(state='PROGRESS', meta={'status': 'Analyzing video for template match...'})
         
-        clip = VideoFileClip(video_path)
-        video_duration = clip.duration
-        clip.close()
-
-        detected_points = analyze_video_for_changes(video_path, sensitivity=sensitivity)
+        decoded_frames = {}
+        with timed(timings, 'analysis'):
+            matches = analyze_video_for_changes(video_path, sensitivity=sensitivity, sample_interval=sample_interval,
+                                                shards=analysis_shards, use_prefilter=use_prefilter,
+                                                index_dir=cache.source_dir(source_key),
+                                                full_scan=full_scan, all_occurrences=all_occurrences,
+                                                proxy=proxy, decoded_frames=decoded_frames,
+                                                source_key=source_key, timings=timings, counters=counters)
+        if proxy:
+            wait_for_video()
+            os.remove(proxy['path'])
+            remove_probe(proxy['path'])
+        # Probed only now: a video-only proxy can be shorter than the full file.
+        with timed(timings, 'probe'):
+            video_duration = probe(video_path)['duration']
+        if downloading:
+            video_path = cache.put_source(source_key, video_path)
+        detected_points = [match['time'] for match in matches]
+        matched_templates = {match['time']: match['template'] for match in matches}
         all_points = sorted(list(set([0] + detected_points + [video_duration])))
 
+        self.update_state(state='PROGRESS', meta={'status': f'Generating {len(all_points) - 1} thumbnail(s)...'})
+        with timed(timings, 'thumbnails'):
+            thumbnail_urls = extract_thumbnails(video_path, all_points[:-1], thumbnail_dir, decoded_frames)
+        thumbnail_files = [os.path.join(thumbnail_dir, os.path.basename(url)) for url in thumbnail_urls if url]
+        add_counts(counters, thumbnails=len(thumbnail_files))
+
         segments = []
-        total_segments = len(all_points) - 1
-        for i in range(total_segments):
-            self.update_state(state='PROGRESS', meta={'status': f'Generating thumbnail {i+1} of {total_segments}...'})
+        for i in range(len(all_points) - 1):
             start = all_points[i]
             end = all_points[i+1]
             if end > start:
-                thumbnail_url = extract_frame_as_jpeg(video_path, start, thumbnail_dir)
                 segments.append({
-                    "index": i, "start": start, "end": end, "thumbnail": thumbnail_url
+                    "index": i, "start": start, "end": end, "thumbnail": thumbnail_urls[i],
+                    "template": matched_templates.get(start)
                 })
         
         result_data = {
@@ -56,257 +180,366 @@ def start_analysis_task(self, sensitivity, thumbnail_dir, upload_dir, video_path
             'original_url': original_url,
             'youtube_video_id': youtube_video_id
         }
-        
-        return {'status': 'Analysis Complete', 'result': result_data}
+        cache.put_analysis(source_key, analysis_key, result_data, thumbnail_files)
+        cache.evict()
+
+        _record_metrics(self, timings, counters)
+        return {'status': 'Analysis Complete', 'result': result_data, 'cache': 'miss',
+                'timings': timings, 'counters': counters}
 
     except Exception as e:
         self.update_state(state='FAILURE', meta={'status': f'An error occurred: {str(e)}'})
         raise e
 
+@celery.task
+def refresh_channel_listing(channel_url=None):
+    """
+    Fetches the channel's latest streams into the listing cache the index page reads.
+    Run by beat for the saved channel, and by the web process (with `channel_url`)
+    when a listing is missing or stale. A failed fetch keeps the previous videos and
+    records the error, so the page neither empties nor retries on every view.
+    """
+    channel_url = channel_url or read_channel_url()
+    if not channel_url:
+        return None
+    client = celery.backend.client
+    try:
+        videos, error = fetch_latest_videos(channel_url), None
+    except Exception as e:
+        print(f"Could not fetch videos from {channel_url}: {e}")
+        previous = read_listing(client, channel_url)
+        videos, error = (previous['videos'] if previous else []), str(e)
+    write_listing(client, channel_url, videos, error)
+    return {'channel_url': channel_url, 'videos': len(videos), 'error': error}
+
+
+# Per-task progress of each segment subtask (subtask id -> fraction done), so the
+# percentage adds up across workers.
+SEGMENT_PROGRESS_KEY = 'segment-progress:{}'
+SEGMENT_PROGRESS_TTL = 24 * 3600
+
+
 @celery.task(bind=True)
-def process_video_segments(self, video_path, jobs, output_dir):
+def process_video_segments(self, video_path, jobs, output_dir, transcription_mode='segment', cut_mode=DEFAULT_CUT_MODE):
     """
-    Celery task to process a list of jobs, creating a separate file for each segment.
+    Celery task to process a list of jobs, creating a separate file for each segment
+    (see plan_segment_exports and transcribe_ranges). `cut_mode` is passed to cut_video
+    and the cut actually made for each file is reported under 'cuts'.
     """
-    base_name = os.path.splitext(os.path.basename(video_path))[0]
-    total_jobs = len(jobs)
-    
+    touch_source(video_path)
     try:
-        clip = VideoFileClip(video_path)
-        has_audio = clip.audio is not None
-        clip.close()
+        has_audio = probe(video_path)['has_audio']
     except Exception:
         has_audio = False
 
-    output_files = {'video': [], 'audio': [], 'text': []}
+    steps = plan_segment_exports(video_path, jobs, output_dir, has_audio, cut_mode)
+    encode_steps = [step for step in steps if step['ffmpeg_args'] or step['video_cut']]
+    text_jobs = [{'ranges': [(step['start'], step['end'])], 'path': step['outputs']['txt']}
+                 for step in steps if step['transcribe']]
+    text_batches = [text_jobs] if transcription_mode == 'source' and text_jobs else [[job] for job in text_jobs]
+    total_steps = len(encode_steps) + len(text_batches)
+
+    self.update_state(state='PROGRESS', meta={'status': f'Processing {len(steps)} segment(s)...', 'percent': 0})
+    celery.backend.client.delete(SEGMENT_PROGRESS_KEY.format(self.request.id))
+    subtasks = [export_segment.s(video_path, step, self.request.id, total_steps) for step in encode_steps]
+    subtasks += [transcribe_ranges.s(video_path, batch, transcription_mode, self.request.id, total_steps)
+                 for batch in text_batches]
+    if not subtasks:
+        return collect_segment_exports([], video_path, cut_mode, {}, self.request.id)
+    return self.replace(chord(group(subtasks), collect_segment_exports.s(video_path, cut_mode, {}, self.request.id)))
 
-    for i, job in enumerate(jobs):
-        self.update_state(state='PROGRESS', meta={'status': f'Processing segment {i+1} of {total_jobs}...'})
-        start_time = job['start']
-        end_time = job['end']
-        formats = job['formats']
-        
-        if end_time > start_time:
-            segment_name = f"{base_name}_segment_at_{int(start_time)}s"
-            segment_video_path = os.path.join(output_dir, f"{segment_name}.mp4")
-            segment_audio_path = os.path.join(output_dir, f"{segment_name}.mp3")
-            segment_text_path = os.path.join(output_dir, f"{segment_name}.txt")
 
+def _report_subtask_progress(task, parent_id, total_steps, fraction):
+    """Records how far (0 to 1) this subtask is and updates the parent's overall percentage."""
+    progress_key = SEGMENT_PROGRESS_KEY.format(parent_id)
+    celery.backend.client.hset(progress_key, task.request.id, min(1.0, fraction))
+    celery.backend.client.expire(progress_key, SEGMENT_PROGRESS_TTL)
+    fractions = [float(value) for value in celery.backend.client.hvals(progress_key)]
+    done = sum(1 for value in fractions if value >= 1.0)
+    task.update_state(task_id=parent_id, state='PROGRESS',
+                      meta={'status': f'Processed segment {done} of {total_steps}...',
+                            'percent': int(sum(fractions) / total_steps * 100)})
+
+
+def _ffmpeg_progress(report, duration):
+    """
+    A run_ffmpeg progress callback calling report(fraction, speed) each time another
+    whole percent of the `duration` seconds being written is done.
+    """
+    reported = {'percent': -1}
+
+    def on_progress(seconds, speed):
+        fraction = min(1.0, seconds / duration) if duration > 0 else 0.0
+        if int(fraction * 100) != reported['percent']:
+            reported['percent'] = int(fraction * 100)
+            report(fraction, speed)
+    return on_progress
+
+
+def _count_outputs(counters, paths, media_seconds):
+    for path in paths:
+        if os.path.exists(path):
+            add_counts(counters, bytes_written=os.path.getsize(path), media_seconds_written=media_seconds)
+
+
+@celery.task(bind=True)
+def export_segment(self, video_path, step, parent_id, total_steps):
+    """
+    Writes the MP4/MP3 of one planned range (see plan_segment_exports) and returns its
+    share of the output_files dict. Failures are logged and give an empty share, as they
+    would have when segments ran in a loop, so one bad range doesn't sink the chord.
+    """
+    outputs = step['outputs']
+    part = {'video': [], 'audio': [], 'text': [], 'cuts': [], 'timings': {}, 'counters': {}}
+    duration = step['end'] - step['start']
+
+    def report(fraction, speed):
+        _report_subtask_progress(self, parent_id, total_steps, fraction)
+    try:
+        with source_in_use(video_path), timed(part['timings'], 'export'):
+            if step['video_cut']:
+                cut = cut_video(video_path, step['start'], step['end'], outputs['mp4'], step['video_cut'])
+            else:
+                cut = {'mode': 'exact', 'start': step['start'], 'end': step['end']}
+            if step['ffmpeg_args']:
+                run_ffmpeg(step['ffmpeg_args'], progress=_ffmpeg_progress(report, duration))
+
+        if 'mp4' in outputs and os.path.exists(outputs['mp4']):
+            part['video'].append(os.path.basename(outputs['mp4']))
+            part['cuts'].append({'file': os.path.basename(outputs['mp4']), 'requested_start': step['start'],
+                                 'requested_end': step['end'], **cut})
+        if 'mp3' in outputs and os.path.exists(outputs['mp3']):
+            part['audio'].append(os.path.basename(outputs['mp3']))
+        _count_outputs(part['counters'], [outputs[fmt] for fmt in ('mp4', 'mp3') if fmt in outputs], duration)
+    except Exception as e:
+        print(f"ERROR processing segment at {step['start']}s: {e}")
+
+    _report_subtask_progress(self, parent_id, total_steps, 1.0)
+    _record_metrics(self, part['timings'], part['counters'])
+    return part
+
+
+@celery.task(bind=True)
+def transcribe_ranges(self, video_path, text_jobs, transcription_mode, parent_id, total_steps):
+    """
+    Writes a text file per {'ranges', 'path'} job: the ranges' audio joined and run
+    through Whisper, or with transcription_mode='source' the matching slices of the
+    whole-video transcript, which is only made once per source. Returns a share of
+    output_files like export_segment.
+    """
+    part = {'video': [], 'audio': [], 'text': [], 'cuts': [], 'timings': {}, 'counters': {}}
+    with source_in_use(video_path):
+        for i, job in enumerate(text_jobs):
             try:
-                duration = end_time - start_time
-                cmd_video = (f'ffmpeg -y -ss {start_time} -i "{video_path}" -t {duration} '
-                             f'-c:v libx264 -c:a aac "{segment_video_path}"')
-                
-                needs_mp4 = 'mp4' in formats
-                needs_audio_file = 'mp3' in formats or 'txt' in formats
-                
-                if needs_mp4:
-                    os.system(cmd_video)
-                    if os.path.exists(segment_video_path):
-                        output_files['video'].append(os.path.basename(segment_video_path))
-                
-                if has_audio and needs_audio_file:
-                    audio_source_path = segment_video_path
-                    if not needs_mp4:
-                        audio_source_path = os.path.join(output_dir, f"temp_audio_{i+1}.mp3")
-                        cmd_temp_audio = f'ffmpeg -y -ss {start_time} -i "{video_path}" -t {duration} -vn -q:a 0 "{audio_source_path}"'
-                        os.system(cmd_temp_audio)
-
-                    if os.path.exists(audio_source_path):
-                        if 'mp3' in formats:
-                            if not needs_mp4:
-                                shutil.move(audio_source_path, segment_audio_path)
-                            else:
-                                cmd_audio_extract = f'ffmpeg -y -i "{audio_source_path}" -vn -q:a 0 "{segment_audio_path}"'
-                                os.system(cmd_audio_extract)
-                            
-                            if os.path.exists(segment_audio_path):
-                                output_files['audio'].append(os.path.basename(segment_audio_path))
-                        
-                        if 'txt' in formats:
-                            transcription_source = segment_audio_path if 'mp3' in formats and os.path.exists(segment_audio_path) else audio_source_path
-                            transcribed_text = transcribe_audio(transcription_source)
-                            with open(segment_text_path, 'w', encoding='utf-8') as f:
-                                f.write(transcribed_text)
-                            if os.path.exists(segment_text_path):
-                                output_files['text'].append(os.path.basename(segment_text_path))
-
-                        if not needs_mp4 and os.path.exists(audio_source_path):
-                            os.remove(audio_source_path)
+                if transcription_mode == 'source':
+                    transcript = get_source_transcript(video_path, part['timings'])
+                    transcribed_text = ' '.join(slice_transcript(transcript, start_time, end_time)
+                                                for start_time, end_time in job['ranges'])
+                else:
+                    with timed(part['timings'], 'audio_extract'):
+                        pcm = run_ffmpeg(transcription_args(video_path, job['ranges']))
+                    transcribed_text = transcribe_audio(pcm_to_float(pcm), part['timings'])
+                with open(job['path'], 'w', encoding='utf-8') as f:
+                    f.write(transcribed_text)
+                part['text'].append(os.path.basename(job['path']))
+                _count_outputs(part['counters'], [job['path']], sum(end - start for start, end in job['ranges']))
             except Exception as e:
-                print(f"ERROR processing segment: {e}")
-    
-    if os.path.exists(video_path):
-        os.remove(video_path)
+                print(f"ERROR transcribing {job['path']}: {e}")
+            if i + 1 < len(text_jobs):
+                _report_subtask_progress(self, parent_id, total_steps, (i + 1) / len(text_jobs))
 
-    return {'status': 'Task complete!', 'result': output_files}
+    _report_subtask_progress(self, parent_id, total_steps, 1.0)
+    _record_metrics(self, part['timings'], part['counters'])
+    return part
 
 
 @celery.task(bind=True)
-def process_and_concatenate_segments(self, video_path, jobs, output_dir):
+def collect_segment_exports(self, parts, video_path, cut_mode, timings, parent_id, output_files=None, counters=None):
+    """
+    Chord callback: merges the subtask results, in order, into `output_files` (a fresh
+    one unless a task already filled part of it). process_video_segments replaces
+    itself with a chord of one export_segment per range on the encode queue and
+    transcribe_ranges on the transcribe queue (a single one in source mode, so the
+    source is only transcribed once), so this produces its result under the same task
+    id; the subtasks report their progress (ffmpeg's own for encodes) as its 'percent'.
+    The source stays in the analysis cache for the next export; AnalysisCache.evict()
+    removes it eventually.
+    The job's total 'timings' and 'counters' are returned alongside.
+    """
+    if output_files is None:
+        output_files = {'video': [], 'audio': [], 'text': [], 'cuts': [], 'cut_mode': cut_mode}
+    timings = dict(timings)
+    counters = dict(counters or {})
+    for part in parts:
+        for key in ('video', 'audio', 'text', 'cuts'):
+            output_files[key].extend(part[key])
+        merge_metrics(timings, counters, part)
+
+    touch_source(video_path)
+    celery.backend.client.delete(SEGMENT_PROGRESS_KEY.format(parent_id))
+
+    return {'status': 'Task complete!', 'result': output_files, 'timings': timings, 'counters': counters}
+
+
+@celery.task(bind=True)
+def process_and_concatenate_segments(self, video_path, jobs, output_dir, transcription_mode='segment',
+                                     cut_mode=DEFAULT_CUT_MODE):
     """
     Celery task to create and concatenate segments into single files.
+    The combined MP4/MP3 are written by one ffmpeg run straight from the source (see
+    plan_concat_export): no per-range temp segments, and only the requested formats.
+    Its progress report drives this task's 'percent' and 'ffmpeg_speed'.
+    `cut_mode` 'copy' stream-copies keyframe-aligned ranges; 'exact' and 'smart' are
+    frame-accurate. The combined text is handed to a transcribe_ranges subtask on the
+    transcribe queue; with transcription_mode='source' it is stitched together from
+    slices of a single whole-video transcript.
     """
-    base_name = os.path.splitext(os.path.basename(video_path))[0]
-    output_files = {'video': [], 'audio': [], 'text': []}
-    temp_video_files = []
-    total_jobs = len(jobs)
-    
-    self.update_state(state='PROGRESS', meta={'status': 'Creating temporary segments...'})
-    for i, job in enumerate(jobs):
-        self.update_state(state='PROGRESS', meta={'status': f'Creating temporary segment {i+1} of {total_jobs}...'})
-        start_time = job['start']
-        end_time = job['end']
-        
-        if end_time > start_time:
-            temp_segment_path = os.path.join(output_dir, f"temp_concat_{i+1}.mp4")
-            duration = end_time - start_time
-            cmd = (f'ffmpeg -y -ss {start_time} -i "{video_path}" -t {duration} '
-                   f'-c:v libx264 -c:a aac "{temp_segment_path}"')
-            os.system(cmd)
-            if os.path.exists(temp_segment_path):
-                temp_video_files.append(temp_segment_path)
-    
-    if not temp_video_files:
-        return {'status': 'Task failed: No temporary segments created.', 'result': output_files}
-
-    concat_list_path = os.path.join(output_dir, "concat_list.txt")
-    with open(concat_list_path, 'w') as f:
-        for filename in temp_video_files:
-            f.write(f"file '{os.path.basename(filename)}'\n")
-
-    needed_formats = set(fmt for job in jobs for fmt in job['formats'])
-            
-    final_video_path = os.path.join(output_dir, f"{base_name}_combined.mp4")
-    final_audio_path = os.path.join(output_dir, f"{base_name}_combined.mp3")
-    final_text_path = os.path.join(output_dir, f"{base_name}_combined.txt")
-    
+    touch_source(video_path)
     try:
-        if any(f in needed_formats for f in ['mp4', 'mp3', 'txt']):
-            self.update_state(state='PROGRESS', meta={'status': 'Stitching segments together...'})
-            cmd_concat = f'ffmpeg -y -f concat -safe 0 -i "{concat_list_path}" -c copy "{final_video_path}"'
-            os.system(cmd_concat)
-            if os.path.exists(final_video_path):
-                output_files['video'].append(os.path.basename(final_video_path))
-        
-        if 'mp3' in needed_formats and os.path.exists(final_video_path):
-            self.update_state(state='PROGRESS', meta={'status': 'Extracting combined audio...'})
-            cmd_audio = f'ffmpeg -y -i "{final_video_path}" -vn -q:a 0 "{final_audio_path}"'
-            os.system(cmd_audio)
-            if os.path.exists(final_audio_path):
-                output_files['audio'].append(os.path.basename(final_audio_path))
-        
-        if 'txt' in needed_formats and os.path.exists(final_audio_path):
-            self.update_state(state='PROGRESS', meta={'status': 'Transcribing combined audio...'})
-            transcribed_text = transcribe_audio(final_audio_path)
-            with open(final_text_path, 'w', encoding='utf-8') as f:
-                f.write(transcribed_text)
-            if os.path.exists(final_text_path):
-                output_files['text'].append(os.path.basename(final_text_path))
-    finally:
-        self.update_state(state='PROGRESS', meta={'status': 'Cleaning up temporary files...'})
-        if os.path.exists(concat_list_path): os.remove(concat_list_path)
-        for filename in temp_video_files:
-            if os.path.exists(filename): os.remove(filename)
-        if os.path.exists(video_path): os.remove(video_path)
-
-    return {'status': 'Task complete!', 'result': output_files}
+        has_audio = probe(video_path)['has_audio']
+    except Exception:
+        has_audio = False
 
+    output_files = {'video': [], 'audio': [], 'text': [], 'cuts': [], 'cut_mode': cut_mode}
+    timings, counters = {}, {}
+    plan = plan_concat_export(video_path, jobs, output_dir, has_audio, cut_mode)
+    outputs = plan['outputs']
+    selected = [job for job in jobs if job['end'] > job['start']]
+    for i, (job, cut) in enumerate(zip(selected, plan['cuts'])):
+        output_files['cuts'].append({'file': f"segment {i+1}", 'requested_start': job['start'],
+                                     'requested_end': job['end'], **cut})
 
-# --- Helper Functions (Not Celery Tasks) ---
+    if not selected:
+        return {'status': 'Task failed: No segments selected.', 'result': output_files}
 
-def extract_frame_as_jpeg(video_path, time_in_seconds, output_dir):
-    try:
-        os.makedirs(output_dir, exist_ok=True)
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            return None
-        
-        cap.set(cv2.CAP_PROP_POS_MSEC, time_in_seconds * 1000)
-        ret, frame = cap.read()
-        cap.release()
-        
-        if ret:
-            safe_filename = os.path.basename(video_path).replace(" ", "_")
-            thumbnail_filename = f"thumb_{safe_filename}_{int(time_in_seconds)}.jpg"
-            thumbnail_path = os.path.join(output_dir, thumbnail_filename)
-            cv2.imwrite(thumbnail_path, frame)
-            return os.path.join('thumbnails', thumbnail_filename)
-        return None
-    except Exception as e:
-        print(f"Error extracting frame: {e}")
-        return None
+    combined_duration = sum(cut['end'] - cut['start'] for cut in plan['cuts'])
+    if plan['ffmpeg_args']:
+        self.update_state(state='PROGRESS', meta={'status': 'Stitching segments together...', 'percent': 0})
+
+        def report(fraction, speed):
+            self.update_state(state='PROGRESS', meta={'status': 'Stitching segments together...',
+                                                      'percent': int(fraction * 100), 'ffmpeg_speed': speed})
+        try:
+            with source_in_use(video_path), timed(timings, 'export'):
+                run_ffmpeg(plan['ffmpeg_args'], plan['stdin'], progress=_ffmpeg_progress(report, combined_duration))
+        except FFmpegError as e:
+            print(f"ERROR stitching segments: {e}")
+            return {'status': 'Task failed: Could not stitch segments.', 'result': output_files}
+
+    if 'mp4' in outputs and os.path.exists(outputs['mp4']):
+        output_files['video'].append(os.path.basename(outputs['mp4']))
+    if 'mp3' in outputs and os.path.exists(outputs['mp3']):
+        output_files['audio'].append(os.path.basename(outputs['mp3']))
+    _count_outputs(counters, [outputs[fmt] for fmt in ('mp4', 'mp3') if fmt in outputs], combined_duration)
+    _record_metrics(self, timings, counters)
 
-def transcribe_audio(audio_path):
-    print(f"Loading transcription model and transcribing {audio_path}...")
+    if not plan['transcribe']:
+        return collect_segment_exports([], video_path, cut_mode, timings, self.request.id, output_files, counters)
+
+    self.update_state(state='PROGRESS', meta={'status': 'Transcribing combined audio...'})
+    text_job = {'ranges': [(cut['start'], cut['end']) for cut in plan['cuts']], 'path': outputs['txt']}
+    callback = collect_segment_exports.s(video_path, cut_mode, timings, self.request.id, output_files, counters)
+    return self.replace(chord([transcribe_ranges.s(video_path, [text_job], transcription_mode, self.request.id, 1)],
+                              callback))
+
+
+# --- Helper Functions (Not Celery Tasks) ---
+
+def transcribe_audio(audio, timings=None):
+    """
+    Transcribes a file path or a 16kHz float32 array with the worker's pooled Whisper
+    model. Model load and inference seconds are added to `timings` when a dict is passed in.
+    """
+    print(f"Transcribing {audio if isinstance(audio, str) else f'{len(audio) / 16000:.1f}s of audio'}...")
     try:
-        model = whisper.load_model("base")
-        result = model.transcribe(audio_path)
+        result, stage_timings = whisper_pool.transcribe(audio)
+        print(f"Transcribed in {stage_timings['transcription']:.1f}s (model load {stage_timings['model_load']:.1f}s).")
+        for stage, seconds in stage_timings.items():
+            add_timing(timings, stage, seconds)
         return result["text"]
     except Exception as e:
         print(f"Error during transcription: {e}")
         return "Transcription failed."
 
-def analyze_video_for_changes(video_path, sensitivity=80):
+def analyze_video_for_changes(video_path, sensitivity=80, sample_interval=1.0, sampling_strategy='auto', shards=None,
+                              coarse_width=COARSE_MAX_WIDTH, use_prefilter=True, index_dir=None,
+                              full_scan=False, all_occurrences=False, proxy=None, decoded_frames=None,
+                              source_key=None, timings=None, counters=None):
     """
-    Analyzes video to find the FIRST scene that matches the template.jpg
-    with a feature count greater than the sensitivity threshold, then stops.
+    Finds the first scene where one of the registered templates (template.jpg plus any
+    images in config/match_templates) has more than `sensitivity` good matches.
+    Returns a list of {'time', 'template', 'good_matches'} dicts: that first match, or
+    every separate appearance of a template with `all_occurrences`.
+
+    The search is find_first_match_coarse_to_fine(), unless a MatchScoreIndex saved in
+    `index_dir` answers it (`full_scan` and `all_occurrences` build one, see build_index).
+    Matched frames go into `decoded_frames`, and stage seconds and frame counts into
+    `timings` and `counters`, when dicts are passed in.
     """
     print(f"Analyzing video for first template match > {sensitivity} features...")
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        return []
-
     try:
-        template = cv2.imread("template.jpg", 0)
-        if template is None:
-            raise FileNotFoundError("template.jpg not found or could not be read.")
-        
-        orb = cv2.ORB_create(nfeatures=2000)
-        kp_template, des_template = orb.detectAndCompute(template, None)
-        
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
-        print("Template image loaded successfully.")
+        registry = load_registry()
+        prefilter = PrefilterCascade(registry.paths) if use_prefilter else None
+        matcher = TemplateMatcher(registry, prefilter=prefilter)
+        print(f"Loaded {len(registry.names)} template(s): {', '.join(registry.names)}.")
     except Exception as e:
         print(f"FATAL: Could not load template. Error: {e}")
         return []
 
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps == 0:
-        fps = 30
-    
-    cut_points = []
-    frame_num = 0
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        # Analyze one frame per second for efficiency
-        if frame_num % int(fps) == 0:
-            print(f"Analyzing frame at {frame_num / fps:.2f}s...")
-            gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            kp_frame, des_frame = orb.detectAndCompute(gray_frame, None)
-            if des_frame is not None and len(des_frame) > 0:
-                matches = bf.knnMatch(des_template, des_frame, k=2)
-                
-                good_matches = []
-                for match_pair in matches:
-                     if len(match_pair) == 2:
-                        m, n = match_pair
-                        if m.distance < 0.75 * n.distance:
-                            good_matches.append(m)
-
-                if len(good_matches) > sensitivity:
-                    timestamp = frame_num / fps
-                    print(f"Match found at {timestamp:.2f}s with {len(good_matches)} features (Threshold: {sensitivity}).")
-                    cut_points.append(timestamp)
-                    break # Stop searching after the first match
-
-        frame_num += 1
-
-    cap.release()
-    print(f"Analysis complete. Found {len(cut_points)} template match(es).")
-    return cut_points
+    index = None
+    index_path = None
+    if index_dir:
+        if not source_key and proxy:
+            proxy['wait_for_video']()
+        key = index_key(source_key or hash_file(video_path), registry.fingerprint, sample_interval=sample_interval,
+                        prefilter=use_prefilter)
+        index_path = os.path.join(index_dir, f"index-{key}.npz")
+        index = MatchScoreIndex.load(index_path)
+        if index is not None:
+            print(f"Using saved match index {index_path}.")
+
+    if index is None and (full_scan or all_occurrences):
+        if proxy:
+            proxy['wait_for_video']()
+        index = build_index(video_path, matcher, sample_interval, sampling_strategy, shards)
+        if index is not None and index_path:
+            index.save(index_path)
+
+    hits = []
+    if index is not None:
+        for run in index.candidate_runs(sensitivity):
+            for candidate_frame in run:
+                if proxy:
+                    proxy['wait_for_video']()
+                hit = refine_proxy_candidate(video_path, matcher, sensitivity, candidate_frame / index.fps,
+                                             sample_interval, decoded_frames)
+                if hit is not None:
+                    hits.append(hit)
+                    break
+            if hits and not all_occurrences:
+                break
+    else:
+        hit = find_first_match_coarse_to_fine(video_path, matcher, sensitivity, sample_interval, sampling_strategy,
+                                              shards=shards, coarse_width=coarse_width, proxy=proxy,
+                                              found_frames=decoded_frames)
+        if hit is not None:
+            hits.append(hit)
+
+    if prefilter is not None:
+        stats = prefilter.stats()
+        print(f"Prefilter passed {stats['passed']} of {stats['checked']} frames, rejected: {stats['rejected']}")
+        add_counts(counters, frames_prefilter_rejected=stats['checked'] - stats['passed'])
+    scan_counts, scan_seconds = matcher.stats.snapshot()
+    print(f"Decoded {scan_counts['frames_decoded']} frames ({scan_seconds['decode']:.1f}s), sampled "
+          f"{scan_counts['frames_sampled']}, ran ORB on {scan_counts['frames_matched']} ({scan_seconds['orb_matching']:.1f}s).")
+    add_counts(counters, **scan_counts)
+    for stage, seconds in scan_seconds.items():
+        add_timing(timings, stage, seconds)
+
+    found = []
+    for frame_num, timestamp, good_matches, template_name in hits:
+        print(f"Match for '{template_name}' found at {timestamp:.2f}s with {good_matches} features (Threshold: {sensitivity}).")
+        found.append({'time': timestamp, 'template': template_name, 'good_matches': good_matches})
+
+    print(f"Analysis complete. Found {len(found)} template match(es).")
+    return found
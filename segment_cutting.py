@@ -0,0 +1,186 @@
+import bisect
+import os
+import subprocess
+import tempfile
+import uuid
+from media_probe import keyframe_times, video_codec
+
+CUT_MODES = ('exact', 'copy', 'smart')
+DEFAULT_CUT_MODE = 'exact'
+
+# A stream-copy input seek lands on the keyframe at or before the requested time,
+# so aim just past the keyframe to make sure rounding never picks the previous one.
+KEYFRAME_SEEK_MARGIN = 0.001
+
+# Cores one ffmpeg run may use for decoding and for x264 (0 leaves it to ffmpeg, which
+# takes every core). Set per worker so encodes don't starve whatever shares the box.
+FFMPEG_THREADS = int(os.environ.get('FFMPEG_THREADS', 0))
+
+# Smart cuts splice fresh x264 output onto copied source packets, which only works
+# when the source is H.264 as well.
+SMART_CUT_CODECS = {'h264'}
+
+
+class FFmpegError(RuntimeError):
+    pass
+
+
+def thread_args():
+    return ['-threads', str(FFMPEG_THREADS)] if FFMPEG_THREADS else []
+
+
+def run_ffmpeg(args, stdin=None, progress=None):
+    """
+    Runs ffmpeg, raising FFmpegError with the tail of stderr on a non-zero exit.
+    `stdin` bytes are fed to the process (for 'pipe:0' inputs). Returns stdout bytes.
+    Every input's decoder is held to FFMPEG_THREADS; encoders take thread_args() themselves.
+
+    With a `progress` callback, ffmpeg's -progress report is read from stdout as it
+    runs and progress(seconds_written, speed) is called on every update (speed is the
+    realtime factor ffmpeg reports, None until known). The outputs must not write to
+    stdout themselves then; nothing is returned.
+    """
+    command = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error']
+    if stdin is None:
+        command.append('-nostdin')
+    if progress is not None:
+        command += ['-progress', 'pipe:1', '-nostats']
+    for arg in args:
+        if arg == '-i':
+            command += thread_args()
+        command.append(arg)
+    if progress is None:
+        result = subprocess.run(command, input=stdin, capture_output=True)
+        returncode, stdout, stderr = result.returncode, result.stdout, result.stderr
+    else:
+        returncode, stdout, stderr = _run_with_progress(command, stdin, progress)
+    if returncode != 0:
+        stderr = stderr.decode('utf-8', errors='replace').strip()
+        raise FFmpegError(f"ffmpeg exited with {returncode}: {stderr[-1000:]}")
+    return stdout
+
+
+def _run_with_progress(command, stdin, progress):
+    # stderr goes to a file so a chatty run can't fill its pipe while stdout is read.
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE if stdin is not None else None,
+                                   stdout=subprocess.PIPE, stderr=stderr_file)
+        if stdin is not None:
+            process.stdin.write(stdin)
+            process.stdin.close()
+        report = {}
+        for line in process.stdout:
+            key, _, value = line.decode('utf-8', errors='replace').strip().partition('=')
+            report[key] = value
+            if key == 'progress':
+                # out_time_us is in microseconds (out_time_ms, despite its name, too).
+                out_time = report.get('out_time_us') or report.get('out_time_ms') or ''
+                speed = report.get('speed', '').rstrip('x')
+                try:
+                    seconds = max(0.0, int(out_time) / 1000000)
+                except ValueError:
+                    seconds = 0.0
+                try:
+                    speed = float(speed)
+                except ValueError:
+                    speed = None
+                progress(seconds, speed)
+                report = {}
+        process.stdout.close()
+        returncode = process.wait()
+        stderr_file.seek(0)
+        return returncode, b'', stderr_file.read()
+
+
+def encode_range(video_path, start_time, end_time, output_path):
+    run_ffmpeg(['-ss', f'{start_time}', '-i', video_path, '-t', f'{end_time - start_time}',
+                '-c:v', 'libx264'] + thread_args() + ['-c:a', 'aac', output_path])
+
+
+def copy_range(video_path, start_time, end_time, output_path, audio_codec='copy'):
+    """Muxes [start_time, end_time) without touching the video; start_time must be a keyframe."""
+    run_ffmpeg(['-ss', f'{start_time + KEYFRAME_SEEK_MARGIN}', '-i', video_path, '-t', f'{end_time - start_time}',
+                '-c:v', 'copy', '-c:a', audio_codec, '-avoid_negative_ts', 'make_zero', output_path])
+
+
+def nearest_keyframe(keyframes, time_in_seconds):
+    position = bisect.bisect_left(keyframes, time_in_seconds)
+    neighbours = keyframes[max(0, position - 1):position + 1]
+    return min(neighbours, key=lambda kf: abs(kf - time_in_seconds))
+
+
+def copy_start(keyframes, start_time, end_time):
+    """
+    Keyframe a stream copy of [start_time, end_time) starts from: the nearest one, or
+    the last one before start_time when the nearest is at or past end_time. None when
+    there is neither, and the range has to be re-encoded.
+    """
+    if not keyframes:
+        return None
+    snapped_start = nearest_keyframe(keyframes, start_time)
+    if snapped_start < end_time:
+        return snapped_start
+    position = bisect.bisect_right(keyframes, start_time)
+    return keyframes[position - 1] if position else None
+
+
+def cut_video(video_path, start_time, end_time, output_path, mode=DEFAULT_CUT_MODE):
+    """
+    Writes [start_time, end_time) of the source to `output_path`.
+
+      - 'exact' re-encodes the whole range, frame-accurate.
+      - 'copy' moves the start to a keyframe (see copy_start) and stream-copies, no re-encode.
+      - 'smart' re-encodes only the partial GOPs before the first and after the last
+        keyframe inside the range and stream-copies everything between them.
+
+    Returns {'mode', 'start', 'end'} describing the cut actually made. 'copy' falls back
+    to 'exact' when there is no keyframe to start from, and 'smart' when the source
+    isn't H.264 or no keyframe falls inside the range.
+    """
+    if mode not in CUT_MODES:
+        raise ValueError(f"Unknown cut mode: {mode}")
+
+    if mode == 'copy':
+        snapped_start = copy_start(keyframe_times(video_path), start_time, end_time)
+        if snapped_start is not None:
+            copy_range(video_path, snapped_start, end_time, output_path)
+            return {'mode': 'copy', 'start': snapped_start, 'end': end_time}
+        mode = 'exact'
+
+    if mode == 'smart':
+        keyframes = keyframe_times(video_path)
+        first = bisect.bisect_left(keyframes, start_time)
+        last = bisect.bisect_right(keyframes, end_time) - 1
+        if video_codec(video_path) in SMART_CUT_CODECS and first < last:
+            smart_cut(video_path, start_time, end_time, keyframes[first], keyframes[last], output_path)
+            return {'mode': 'smart', 'start': start_time, 'end': end_time}
+        mode = 'exact'
+
+    encode_range(video_path, start_time, end_time, output_path)
+    return {'mode': mode, 'start': start_time, 'end': end_time}
+
+
+def smart_cut(video_path, start_time, end_time, first_keyframe, last_keyframe, output_path):
+    work_dir = os.path.dirname(os.path.abspath(output_path))
+    token = uuid.uuid4().hex[:8]
+    parts = []
+    concat_list_path = os.path.join(work_dir, f"smartcut_{token}.txt")
+    try:
+        if first_keyframe > start_time:
+            parts.append(os.path.join(work_dir, f"smartcut_{token}_head.mp4"))
+            encode_range(video_path, start_time, first_keyframe, parts[-1])
+        parts.append(os.path.join(work_dir, f"smartcut_{token}_body.mp4"))
+        # Audio is re-encoded to AAC throughout so every part shares the same audio codec.
+        copy_range(video_path, first_keyframe, last_keyframe, parts[-1], audio_codec='aac')
+        if end_time > last_keyframe:
+            parts.append(os.path.join(work_dir, f"smartcut_{token}_tail.mp4"))
+            encode_range(video_path, last_keyframe, end_time, parts[-1])
+
+        with open(concat_list_path, 'w') as f:
+            for part in parts:
+                f.write(f"file '{os.path.basename(part)}'\n")
+        run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', concat_list_path, '-c', 'copy', output_path])
+    finally:
+        for path in parts + [concat_list_path]:
+            if os.path.exists(path):
+                os.remove(path)
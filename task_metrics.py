@@ -0,0 +1,107 @@
+import time
+from contextlib import contextmanager
+
+# Redis hash holding the analysis cache's 'hit' and 'miss' counts.
+ANALYSIS_CACHE_STATS_KEY = 'analysis-cache:stats'
+
+# Redis hashes the workers add every task's metrics to, with "<task>|<name>" fields;
+# /metrics in app.py reads them back.
+STAGE_SECONDS_KEY = 'metrics:stage-seconds'
+COUNTERS_KEY = 'metrics:counters'
+TASK_RUNS_KEY = 'metrics:task-runs'
+TASK_SECONDS_KEY = 'metrics:task-seconds'
+
+METRIC_PREFIX = 'quickedit'
+
+
+def add_timing(timings, stage, seconds):
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def add_counts(counters, **counts):
+    if counters is not None:
+        for name, value in counts.items():
+            counters[name] = counters.get(name, 0) + value
+
+
+@contextmanager
+def timed(timings, stage):
+    """Adds the seconds spent in the block to timings[stage]."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(timings, stage, time.perf_counter() - started)
+
+
+def merge_metrics(timings, counters, part):
+    """Adds a subtask's {'timings', 'counters'} into the caller's dicts."""
+    for stage, seconds in part.get('timings', {}).items():
+        add_timing(timings, stage, seconds)
+    add_counts(counters, **part.get('counters', {}))
+
+
+def _task_label(task_name):
+    return task_name.rsplit('.', 1)[-1]
+
+
+def record_metrics(client, task_name, timings, counters):
+    """Adds one task's stage seconds and counters to the totals in Redis."""
+    task = _task_label(task_name)
+    with client.pipeline() as pipe:
+        for stage, seconds in timings.items():
+            pipe.hincrbyfloat(STAGE_SECONDS_KEY, f"{task}|{stage}", seconds)
+        for name, value in counters.items():
+            pipe.hincrbyfloat(COUNTERS_KEY, f"{task}|{name}", value)
+        pipe.execute()
+
+
+def record_task_run(client, task_name, state, seconds):
+    task = _task_label(task_name)
+    with client.pipeline() as pipe:
+        pipe.hincrby(TASK_RUNS_KEY, f"{task}|{state.lower()}", 1)
+        pipe.hincrbyfloat(TASK_SECONDS_KEY, task, seconds)
+        pipe.execute()
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _series(client, key):
+    """A metrics hash as [((task, name), value)], sorted."""
+    series = []
+    for field, value in client.hgetall(key).items():
+        task, _, name = _decode(field).partition('|')
+        series.append(((task, name), float(value)))
+    return sorted(series)
+
+
+def _number(value):
+    return f"{int(value)}" if float(value).is_integer() else f"{value:.6f}"
+
+
+def prometheus_text(client):
+    """Every recorded metric in the Prometheus text exposition format."""
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{label}="{label_value}"' for label, label_value in labels)
+            lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {_number(value)}")
+
+    family('task_runs_total', 'counter', 'Finished task runs by outcome.',
+           [((('task', task), ('state', state)), value) for (task, state), value in _series(client, TASK_RUNS_KEY)])
+    family('task_seconds_total', 'counter', 'Wall seconds spent in each task.',
+           [((('task', task),), value) for (task, _), value in _series(client, TASK_SECONDS_KEY)])
+    family('stage_seconds_total', 'counter', 'Seconds spent in each stage of a task (summed over threads).',
+           [((('task', task), ('stage', stage)), value) for (task, stage), value in _series(client, STAGE_SECONDS_KEY)])
+    family('task_events_total', 'counter', 'Frames, bytes and media seconds processed by each task.',
+           [((('task', task), ('counter', name)), value) for (task, name), value in _series(client, COUNTERS_KEY)])
+    cache_stats = {_decode(field): float(value) for field, value in client.hgetall(ANALYSIS_CACHE_STATS_KEY).items()}
+    family('analysis_cache_requests_total', 'counter', 'Analysis cache lookups by result.',
+           [((('result', result),), cache_stats.get(result, 0)) for result in ('hit', 'miss')])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,92 @@
+import cv2
+import hashlib
+import os
+import numpy as np
+from match_index import hash_file
+
+DEFAULT_TEMPLATE = "template.jpg"
+TEMPLATE_DIR = os.path.join('config', 'match_templates')
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+_registries = {}
+
+
+class TemplateRegistry:
+    """
+    Every template image the analysis looks for. ORB descriptors are computed once per
+    image, feature count and scale, persisted under `cache_dir`, and stacked into a
+    single matrix (with a label per row) so a frame is matched against all templates
+    in one nearest-two search (descriptor_matching.nearest_two, cv2.batchDistance).
+    """
+
+    def __init__(self, paths, nfeatures=2000, cache_dir=os.path.join(TEMPLATE_DIR, '.descriptors')):
+        if not paths:
+            raise FileNotFoundError(f"No templates found: add {DEFAULT_TEMPLATE} or images under {TEMPLATE_DIR}.")
+        self.paths = list(paths)
+        self.names = [os.path.splitext(os.path.basename(path))[0] for path in self.paths]
+        self.hashes = [hash_file(path) for path in self.paths]
+        self.nfeatures = nfeatures
+        self.cache_dir = cache_dir
+        self._stacks = {}
+
+    @property
+    def fingerprint(self):
+        payload = f"{self.nfeatures}:" + ','.join(self.hashes)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def descriptors(self, index, scale=1.0):
+        cache_path = os.path.join(self.cache_dir, f"{self.hashes[index]}_{self.nfeatures}_{scale:.4f}.npy")
+        if os.path.exists(cache_path):
+            return np.load(cache_path)
+
+        template = cv2.imread(self.paths[index], 0)
+        if template is None:
+            raise FileNotFoundError(f"{self.paths[index]} not found or could not be read.")
+        if scale != 1.0:
+            template = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        orb = cv2.ORB_create(nfeatures=self.nfeatures)
+        keypoints, descriptors = orb.detectAndCompute(template, None)
+        if descriptors is None:
+            descriptors = np.empty((0, 32), dtype=np.uint8)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+        np.save(temp_path, descriptors)
+        os.replace(temp_path, cache_path)
+        return descriptors
+
+    def stacked(self, scale=1.0):
+        """Returns (descriptors, labels) for all templates at `scale`, stacked into one matrix."""
+        key = round(scale, 4)
+        if key not in self._stacks:
+            per_template = [self.descriptors(i, scale) for i in range(len(self.paths))]
+            descriptors = np.vstack(per_template)
+            if len(descriptors) == 0:
+                raise ValueError("None of the templates produced any ORB features.")
+            labels = np.concatenate([np.full(len(d), i, dtype=np.int32) for i, d in enumerate(per_template)])
+            self._stacks[key] = (descriptors, labels)
+        return self._stacks[key]
+
+
+def discover_template_paths(template_dir=TEMPLATE_DIR, default_template=DEFAULT_TEMPLATE):
+    paths = []
+    if os.path.exists(default_template):
+        paths.append(default_template)
+    if os.path.isdir(template_dir):
+        for filename in sorted(os.listdir(template_dir)):
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(template_dir, filename))
+    return paths
+
+
+def load_registry(template_dir=TEMPLATE_DIR, default_template=DEFAULT_TEMPLATE, nfeatures=2000):
+    """
+    Returns the registry for the current set of template images, reusing the one
+    already built in this process (with its stacked descriptors) if nothing changed.
+    """
+    registry = TemplateRegistry(discover_template_paths(template_dir, default_template), nfeatures,
+                                cache_dir=os.path.join(template_dir, '.descriptors'))
+    key = (tuple(registry.paths), registry.fingerprint)
+    if key not in _registries:
+        _registries[key] = registry
+    return _registries[key]
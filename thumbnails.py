@@ -0,0 +1,85 @@
+import cv2
+import hashlib
+import os
+from video_analysis import SEEK_MIN_GAP_FRAMES, get_video_fps
+
+# Thumbnails are shrunk to this width (never enlarged) and saved at this JPEG quality.
+THUMBNAIL_WIDTH = int(os.environ.get('THUMBNAIL_WIDTH', 480))
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', 80))
+
+
+def thumbnail_filename(video_path, time_in_seconds, width=THUMBNAIL_WIDTH, quality=THUMBNAIL_QUALITY):
+    """
+    Deterministic name for one thumbnail: the video (by path, size and mtime), the time
+    to the millisecond and the output settings, so an identical request finds the file.
+    """
+    stat = os.stat(video_path)
+    identity = f"{os.path.abspath(video_path)}:{stat.st_size}:{stat.st_mtime}"
+    video_key = hashlib.sha1(identity.encode('utf-8')).hexdigest()[:12]
+    safe_filename = os.path.splitext(os.path.basename(video_path))[0].replace(" ", "_")
+    return f"thumb_{safe_filename}_{video_key}_{int(round(time_in_seconds * 1000))}ms_{width}w{quality}q.jpg"
+
+
+def write_thumbnail(frame, thumbnail_path, width=THUMBNAIL_WIDTH, quality=THUMBNAIL_QUALITY):
+    height, frame_width = frame.shape[:2]
+    if width and frame_width > width:
+        frame = cv2.resize(frame, (width, max(1, int(round(height * width / frame_width)))),
+                           interpolation=cv2.INTER_AREA)
+    temp_path = f"{thumbnail_path}.tmp.jpg"
+    if cv2.imwrite(temp_path, frame, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        os.replace(temp_path, thumbnail_path)
+        return True
+    return False
+
+
+def extract_thumbnails(video_path, times, output_dir, decoded_frames=None, width=THUMBNAIL_WIDTH,
+                       quality=THUMBNAIL_QUALITY):
+    """
+    Writes a thumbnail for each of `times` (seconds) and returns their paths relative to
+    the static folder ('thumbnails/...'), in the same order, None where a frame couldn't
+    be read.
+
+    Thumbnails already on disk are reused as they are, and `decoded_frames`
+    ({timestamp: frame}, e.g. the matching frames kept by the analysis) are used
+    instead of decoding those times again. Everything else is read in one pass over
+    the video in time order, grabbing forward between nearby times and seeking across
+    long gaps.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    decoded_frames = decoded_frames or {}
+    urls = {}
+    pending = []
+    for time_in_seconds in set(times):
+        filename = thumbnail_filename(video_path, time_in_seconds, width, quality)
+        thumbnail_path = os.path.join(output_dir, filename)
+        if os.path.exists(thumbnail_path) or (time_in_seconds in decoded_frames and
+                                              write_thumbnail(decoded_frames[time_in_seconds], thumbnail_path,
+                                                              width, quality)):
+            urls[time_in_seconds] = os.path.join('thumbnails', filename)
+        else:
+            pending.append((time_in_seconds, filename))
+
+    if pending:
+        cap = cv2.VideoCapture(video_path)
+        try:
+            if cap.isOpened():
+                fps = get_video_fps(cap)
+                position = 0
+                for time_in_seconds, filename in sorted(pending):
+                    frame_index = int(round(time_in_seconds * fps))
+                    if frame_index < position or frame_index - position > SEEK_MIN_GAP_FRAMES:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+                        position = frame_index
+                    while position < frame_index and cap.grab():
+                        position += 1
+                    ret, frame = cap.read()
+                    if not ret:
+                        print(f"Could not read a thumbnail frame at {time_in_seconds:.2f}s.")
+                        continue
+                    position += 1
+                    if write_thumbnail(frame, os.path.join(output_dir, filename), width, quality):
+                        urls[time_in_seconds] = os.path.join('thumbnails', filename)
+        finally:
+            cap.release()
+
+    return [urls.get(time_in_seconds) for time_in_seconds in times]
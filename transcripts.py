@@ -0,0 +1,69 @@
+import json
+import os
+import whisper_pool
+
+
+# Transcribing the whole source once beats one Whisper run per range when the ranges
+# to transcribe cover at least this fraction of it.
+SOURCE_TRANSCRIPTION_MIN_COVERAGE = 0.8
+
+
+def choose_transcription_mode(jobs, duration):
+    """
+    'source' (transcribe the whole video once and slice it) when the jobs' txt ranges
+    overlap, so per-range runs would transcribe some audio twice, or together cover most
+    of the video; otherwise 'segment', which only transcribes what was asked for.
+    """
+    ranges = sorted((job['start'], job['end']) for job in jobs if 'txt' in job['formats'])
+    if not ranges or duration <= 0:
+        return 'segment'
+    if any(start < previous_end for (_, previous_end), (start, _) in zip(ranges, ranges[1:])):
+        return 'source'
+    covered = sum(end - start for start, end in ranges)
+    return 'source' if covered >= SOURCE_TRANSCRIPTION_MIN_COVERAGE * duration else 'segment'
+
+
+def transcript_cache_path(video_path, model_size=None):
+    return f"{video_path}.{model_size or whisper_pool.WHISPER_MODEL}.transcript.json"
+
+
+def get_source_transcript(video_path, timings=None):
+    """
+    Timestamped transcript of the whole source, transcribed once and cached next to the
+    video as {'text': ..., 'segments': [{'start', 'end', 'text'}, ...]}. Whisper reads the
+    audio track straight from the video, so nothing else is extracted first.
+    """
+    cache_path = transcript_cache_path(video_path)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    print(f"Transcribing full source {video_path} once for all segments...")
+    result, stage_timings = whisper_pool.transcribe(video_path)
+    if timings is not None:
+        for stage, seconds in stage_timings.items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    transcript = {
+        'text': result['text'],
+        'segments': [{'start': s['start'], 'end': s['end'], 'text': s['text']} for s in result['segments']],
+    }
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(transcript, f)
+    os.replace(temp_path, cache_path)
+    return transcript
+
+
+def slice_transcript(transcript, start_time, end_time):
+    """
+    Text of the transcript segments belonging to [start_time, end_time). A segment that
+    straddles a boundary goes to whichever side holds its midpoint, so adjacent ranges
+    never repeat or drop a sentence.
+    """
+    parts = []
+    for segment in transcript['segments']:
+        midpoint = (segment['start'] + segment['end']) / 2
+        if start_time <= midpoint < end_time:
+            parts.append(segment['text'].strip())
+    return ' '.join(part for part in parts if part)
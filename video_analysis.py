@@ -0,0 +1,486 @@
+import copy
+import cv2
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from descriptor_matching import count_ratio_matches
+from media_probe import keyframe_interval
+
+# A seek lands on average half a keyframe interval before its target and has to
+# decode forward from there, so below that gap it's cheaper to grab() through the
+# frames in between. The interval is measured per file (seek_gap_frames()); this is
+# the fallback when it can't be, half of x264's default of 250 frames.
+SEEK_MIN_GAP_FRAMES = 125
+
+# Cores one analysis may use, for both scan shards and OpenCV's own threads
+# (0 means every core).
+ANALYSIS_THREADS = int(os.environ.get('ANALYSIS_THREADS', 0))
+
+# Shards shorter than this aren't worth opening another capture for.
+MIN_SAMPLES_PER_SHARD = 60
+
+# The coarse pass matches frames (and the template) shrunk towards this width, but
+# never by more than COARSE_MIN_SCALE: a card shown small loses most of its ORB
+# matches below that (a 400 px card in 1080p keeps 8 of 191 at 640 px wide).
+COARSE_MAX_WIDTH = 640
+COARSE_MIN_SCALE = 0.5
+
+# Fewer features survive downscaling, so the coarse pass only needs this
+# fraction of the sensitivity to flag a candidate. The full-resolution pass
+# then confirms it against the real threshold.
+COARSE_THRESHOLD_RATIO = 0.5
+
+
+def get_video_fps(cap):
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not fps or fps != fps:
+        fps = 30
+    return fps
+
+
+class ScanStats:
+    """
+    Counters for one analysis, shared by all of its shards and matchers: frames read
+    or grabbed from the decoder ('frames_decoded'; what a seek decodes on its way to
+    the target isn't visible), frames sampled, frames ORB ran on, and the seconds
+    spent decoding and matching, summed over threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {'frames_decoded': 0, 'frames_sampled': 0, 'frames_matched': 0}
+        self.seconds = {'decode': 0.0, 'orb_matching': 0.0}
+
+    def add(self, seconds=None, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+            for stage, value in (seconds or {}).items():
+                self.seconds[stage] += value
+
+    def snapshot(self):
+        """(counts, seconds) so far."""
+        with self._lock:
+            return dict(self.counts), dict(self.seconds)
+
+
+def seek_gap_frames(video_path, fps):
+    """
+    Gap in frames above which seeking beats grabbing: half the keyframe interval
+    measured at the start of the video, or SEEK_MIN_GAP_FRAMES when it can't be.
+    """
+    try:
+        interval = keyframe_interval(video_path)
+    except (OSError, RuntimeError) as e:
+        print(f"Could not measure the keyframe interval of {video_path}: {e}")
+        interval = None
+    if not interval:
+        return SEEK_MIN_GAP_FRAMES
+    return max(1, int(interval * fps / 2))
+
+
+def sample_frames(cap, sample_interval=1.0, strategy='auto', seek_min_gap=SEEK_MIN_GAP_FRAMES,
+                  start_frame=0, end_frame=None, frame_step=None, stats=None):
+    """
+    Yields (frame_index, timestamp, frame) for one frame every `sample_interval` seconds.
+
+    Samples sit on a fixed grid of frame indices (multiples of the step), so scanning
+    [start_frame, end_frame) visits exactly the samples a full scan would in that range.
+    Only sampled frames are retrieved (converted to BGR and copied out of the decoder):
+      - 'grab' walks the stream with cap.grab() and skips retrieve() on unsampled frames.
+      - 'seek' jumps straight to each sampled frame, so only the frames between the
+        preceding keyframe and the target are decoded.
+      - 'auto' picks 'seek' when samples are more than `seek_min_gap` frames apart
+        (see seek_gap_frames()).
+    `frame_step` overrides the interval with an exact number of frames.
+    Frames decoded and sampled, and the decoding time, are added to a ScanStats `stats`.
+    """
+    fps = get_video_fps(cap)
+    step = frame_step or max(1, int(round(sample_interval * fps)))
+    if strategy == 'auto':
+        strategy = 'seek' if step > seek_min_gap else 'grab'
+    if strategy not in ('seek', 'grab'):
+        raise ValueError(f"Unknown sampling strategy: {strategy}")
+
+    frame_index = -(-start_frame // step) * step
+    position = 0
+    decoded = sampled = 0
+    decode_seconds = 0.0
+
+    try:
+        if strategy == 'seek':
+            while end_frame is None or frame_index < end_frame:
+                started = time.perf_counter()
+                if frame_index != position:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+                ret, frame = cap.read()
+                decode_seconds += time.perf_counter() - started
+                if not ret:
+                    break
+                decoded += 1
+                sampled += 1
+                yield frame_index, frame_index / fps, frame
+                position = frame_index + 1
+                frame_index += step
+        else:
+            if frame_index > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            while end_frame is None or frame_index < end_frame:
+                started = time.perf_counter()
+                if frame_index % step == 0:
+                    ret, frame = cap.read()
+                    decode_seconds += time.perf_counter() - started
+                    if not ret:
+                        break
+                    decoded += 1
+                    sampled += 1
+                    yield frame_index, frame_index / fps, frame
+                else:
+                    ret = cap.grab()
+                    decode_seconds += time.perf_counter() - started
+                    if not ret:
+                        break
+                    decoded += 1
+                frame_index += 1
+    finally:
+        if stats is not None:
+            stats.add({'decode': decode_seconds}, frames_decoded=decoded, frames_sampled=sampled)
+
+
+class TemplateMatcher:
+    """
+    Matches frames against every template in a TemplateRegistry at once: the templates'
+    descriptors are stacked into one query matrix, so a single nearest-two search per
+    frame covers every template row, and the ratio-test survivors are tallied per
+    template through the row labels.
+    With scale < 1 every frame is shrunk by that factor before detection, against
+    template descriptors computed at the same scale. `frame_scale` overrides the frame
+    factor for frames that arrive already shrunk, such as a low-resolution proxy's;
+    `reference_width` is then the width of the video the templates were captured from.
+    An optional PrefilterCascade gets
+    first look at each frame and can skip ORB entirely.
+    ORB detectors aren't safe to share between threads, so every shard works on its
+    own clone(). Clones and scaled() copies add to the same ScanStats.
+    """
+
+    def __init__(self, registry, scale=1.0, prefilter=None, frame_scale=None, stats=None, reference_width=None):
+        self.registry = registry
+        self.names = registry.names
+        self.scale = scale
+        self.frame_scale = scale if frame_scale is None else frame_scale
+        self.prefilter = prefilter
+        self.reference_width = reference_width
+        self.des_templates, self.labels = registry.stacked(scale)
+        self.orb = cv2.ORB_create(nfeatures=registry.nfeatures)
+        self.stats = stats if stats is not None else ScanStats()
+
+    def clone(self):
+        other = copy.copy(self)
+        other.orb = cv2.ORB_create(nfeatures=self.registry.nfeatures)
+        return other
+
+    def scaled(self, scale, frame_scale=None, reference_width=None):
+        return TemplateMatcher(self.registry, scale, self.prefilter, frame_scale, self.stats, reference_width)
+
+    def frame_descriptors(self, frame):
+        """
+        ORB descriptors for one frame plus the prefilter's mask of templates it might
+        still match (None without a prefilter). Descriptors are None when the
+        prefilter rules out every template or nothing is detected.
+        """
+        surviving = None
+        if self.prefilter is not None:
+            surviving = self.prefilter.surviving_templates(frame, self.reference_width)
+            if not surviving.any():
+                return None, surviving
+
+        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.frame_scale != 1.0:
+            gray_frame = cv2.resize(gray_frame, None, fx=self.frame_scale, fy=self.frame_scale,
+                                    interpolation=cv2.INTER_AREA)
+        kp_frame, des_frame = self.orb.detectAndCompute(gray_frame, None)
+        return des_frame, surviving
+
+    def match_counts(self, frame):
+        """Number of good matches for each template, in registry order."""
+        started = time.perf_counter()
+        des_frame, surviving = self.frame_descriptors(frame)
+        counts = count_ratio_matches(self.des_templates, self.labels, len(self.names), des_frame)
+        if surviving is not None:
+            counts[~surviving] = 0
+        self.stats.add({'orb_matching': time.perf_counter() - started}, frames_matched=int(des_frame is not None))
+        return counts
+
+
+def sampling_options(video_path, cap, strategy):
+    """The file-specific sample_frames() arguments `strategy` needs: the seek gap for 'auto'."""
+    if strategy == 'auto':
+        return {'seek_min_gap': seek_gap_frames(video_path, get_video_fps(cap))}
+    return {}
+
+
+def find_first_match(video_path, matcher, sensitivity, sample_interval=1.0, strategy='auto',
+                     start_frame=0, end_frame=None, should_stop=None, frame_step=None, found_frames=None):
+    """
+    Scans [start_frame, end_frame) and returns (frame_index, timestamp, good_matches, template_name)
+    for the first sample where some template has more than `sensitivity` good matches, or None.
+    `should_stop(frame_index)` lets a caller abandon the scan early. The matching frame is
+    kept in `found_frames` under its timestamp when a dict is passed in, so thumbnails
+    don't have to decode it again.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+
+    try:
+        for frame_index, timestamp, frame in sample_frames(cap, sample_interval, strategy, start_frame=start_frame,
+                                                           end_frame=end_frame, frame_step=frame_step,
+                                                           stats=matcher.stats,
+                                                           **sampling_options(video_path, cap, strategy)):
+            if should_stop is not None and should_stop(frame_index):
+                return None
+            print(f"Analyzing frame at {timestamp:.2f}s...")
+            counts = matcher.match_counts(frame)
+            best = int(counts.argmax())
+            if counts[best] > sensitivity:
+                if found_frames is not None:
+                    found_frames[timestamp] = frame
+                return frame_index, timestamp, int(counts[best]), matcher.names[best]
+        return None
+    finally:
+        cap.release()
+
+
+def plan_shards(video_path, sample_interval=1.0, shards=None, start_frame=0):
+    """
+    Splits the sample grid from `start_frame` onwards into contiguous ranges.
+    Returns (fps, step, [(start_frame, end_frame), ...]), or None if the video can't be opened.
+    `shards=None` picks one per core (ANALYSIS_THREADS), as long as each gets a worthwhile number of samples.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    fps = get_video_fps(cap)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    step = max(1, int(round(sample_interval * fps)))
+    first_sample = -(-start_frame // step)
+    total_samples = max(0, -(-frame_count // step) - first_sample) if frame_count > 0 else 0
+    if shards is None:
+        shards = min(ANALYSIS_THREADS or os.cpu_count() or 1, total_samples // MIN_SAMPLES_PER_SHARD)
+    shards = min(shards, total_samples)
+    if shards <= 1:
+        return fps, step, [(start_frame, None)]
+
+    # Shard edges sit on the sample grid; the last shard is left open-ended in
+    # case the container's frame count is an underestimate.
+    starts = [(first_sample + i * total_samples // shards) * step for i in range(shards)]
+    ends = starts[1:] + [None]
+    return fps, step, list(zip(starts, ends))
+
+
+def find_first_match_sharded(video_path, matcher, sensitivity, sample_interval=1.0, strategy='auto', shards=None,
+                             start_frame=0):
+    """
+    Same result as find_first_match(), but the timeline is split into `shards`
+    contiguous ranges scanned concurrently, each with its own capture and matcher.
+    Once a shard confirms a hit, shards starting after it are cancelled and the
+    ones before it stop as soon as they pass it.
+
+    Shards run on threads rather than processes: decoding, ORB and matching all
+    release the GIL, and Celery's prefork workers are daemonic so they can't start
+    a process pool of their own.
+    """
+    plan = plan_shards(video_path, sample_interval, shards, start_frame)
+    if plan is None:
+        return None
+    fps, step, ranges = plan
+    if len(ranges) == 1:
+        return find_first_match(video_path, matcher, sensitivity, sample_interval, strategy, start_frame=start_frame)
+
+    starts = [start for start, end in ranges]
+    print(f"Analyzing in {len(ranges)} parallel shards...")
+
+    lock = threading.Lock()
+    best = {'frame_index': None}
+    futures = []
+
+    def passed_best(frame_index):
+        return best['frame_index'] is not None and frame_index >= best['frame_index']
+
+    def run_shard(start_frame, end_frame):
+        if passed_best(start_frame):
+            return None
+        hit = find_first_match(video_path, matcher.clone(), sensitivity, sample_interval, strategy,
+                               start_frame=start_frame, end_frame=end_frame, should_stop=passed_best)
+        if hit is not None:
+            with lock:
+                if best['frame_index'] is None or hit[0] < best['frame_index']:
+                    best['frame_index'] = hit[0]
+                for future, shard_start in zip(futures, starts):
+                    if shard_start >= hit[0]:
+                        future.cancel()
+        return hit
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        with lock:
+            futures.extend(pool.submit(run_shard, start, end) for start, end in ranges)
+        hits = []
+        for future in futures:
+            try:
+                hits.append(future.result())
+            except CancelledError:
+                pass
+
+    hits = [hit for hit in hits if hit is not None]
+    return min(hits) if hits else None
+
+
+def score_samples(video_path, matcher, sample_interval=1.0, strategy='auto', shards=None):
+    """
+    Scores every sample of the video, with no early exit, using the same shards as
+    find_first_match_sharded(). Returns (fps, frame_indices, counts) where counts has
+    one row per sample and one column per template.
+    """
+    plan = plan_shards(video_path, sample_interval, shards)
+    if plan is None:
+        return None
+    fps, step, ranges = plan
+
+    def run_shard(start_frame, end_frame):
+        shard_matcher = matcher.clone()
+        frame_indices, counts = [], []
+        cap = cv2.VideoCapture(video_path)
+        try:
+            for frame_index, timestamp, frame in sample_frames(cap, sample_interval, strategy,
+                                                               start_frame=start_frame, end_frame=end_frame,
+                                                               stats=shard_matcher.stats,
+                                                               **sampling_options(video_path, cap, strategy)):
+                print(f"Scoring frame at {timestamp:.2f}s...")
+                frame_indices.append(frame_index)
+                counts.append(shard_matcher.match_counts(frame))
+        finally:
+            cap.release()
+        return frame_indices, counts
+
+    print(f"Scoring every sample in {len(ranges)} shard(s)...")
+    frame_indices, counts = [], []
+    with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        for shard_frames, shard_counts in pool.map(lambda r: run_shard(*r), ranges):
+            frame_indices.extend(shard_frames)
+            counts.extend(shard_counts)
+    return fps, frame_indices, counts
+
+
+def coarse_scale(frame_width, coarse_width=COARSE_MAX_WIDTH):
+    """Factor the coarse pass shrinks frames `frame_width` wide by (1.0 for none)."""
+    if not coarse_width or frame_width <= coarse_width:
+        return 1.0
+    return max(coarse_width / frame_width, COARSE_MIN_SCALE)
+
+
+def prepare_coarse_matcher(video_path, matcher, coarse_width=COARSE_MAX_WIDTH, reference_width=None):
+    """
+    Returns (fps, coarse_matcher, threshold_ratio) for searching `video_path` on frames
+    downscaled by coarse_scale(). Videos that are already narrower than `coarse_width`
+    keep the full matcher and the real threshold.
+
+    `reference_width` marks `video_path` as a low-resolution proxy of a video that
+    wide: the templates are shrunk to the proxy's scale as well, and it counts as a
+    coarse pass whatever its width.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    fps = get_video_fps(cap)
+    frame_width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+    cap.release()
+
+    if reference_width and reference_width > frame_width:
+        frame_scale = min(1.0, coarse_width / frame_width) if coarse_width else 1.0
+        coarse_matcher = matcher.scaled(frame_width * frame_scale / reference_width, frame_scale, reference_width)
+        return fps, coarse_matcher, COARSE_THRESHOLD_RATIO
+    scale = coarse_scale(frame_width, coarse_width)
+    if scale < 1.0:
+        return fps, matcher.scaled(scale), COARSE_THRESHOLD_RATIO
+    return fps, matcher, 1.0
+
+
+def refine_candidate(video_path, matcher, sensitivity, candidate_frame, step, found_frames=None):
+    """
+    Checks every frame at full resolution from just after the coarse sample preceding
+    `candidate_frame` up to the next one, and returns the first real match or None.
+    """
+    print(f"Coarse candidate at frame {candidate_frame}, refining at full resolution...")
+    return find_first_match(video_path, matcher, sensitivity, strategy='grab',
+                            start_frame=max(0, candidate_frame - step + 1),
+                            end_frame=candidate_frame + step, frame_step=1, found_frames=found_frames)
+
+
+def refine_proxy_candidate(video_path, matcher, sensitivity, candidate_time, sample_interval=1.0, found_frames=None):
+    """
+    refine_candidate() for a candidate given by time, e.g. one found on a proxy whose
+    frame numbering may differ from `video_path`'s.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    fps = get_video_fps(cap)
+    cap.release()
+    step = max(1, int(round(sample_interval * fps)))
+    return refine_candidate(video_path, matcher, sensitivity, int(round(candidate_time * fps)), step, found_frames)
+
+
+def find_first_match_coarse_to_fine(video_path, matcher, sensitivity, sample_interval=1.0, strategy='auto',
+                                    shards=None, coarse_width=COARSE_MAX_WIDTH, proxy=None, found_frames=None):
+    """
+    Two-stage search for the exact first frame matching the template.
+
+    The coarse pass scans one frame every `sample_interval` seconds, downscaled (see
+    prepare_coarse_matcher), against a loosened threshold. Each candidate it finds is
+    then checked at full resolution frame by frame, from just after the previous coarse
+    sample up to the next one; if none of those frames clear the real sensitivity
+    the coarse scan resumes after the candidate. A card shown too small for the coarse
+    pass to see is still found: when it confirms nothing, the samples are scanned
+    again at full resolution.
+
+    `proxy` ({'path', 'reference_width', 'wait_for_video'}) runs the coarse pass on a
+    low-resolution copy instead, so it can start before `video_path` has finished
+    downloading; wait_for_video() is called before the first full-resolution read.
+    The matching frame goes into `found_frames` as in find_first_match().
+    Returns (frame_index, timestamp, good_matches, template_name) or None.
+    """
+    coarse_path = proxy['path'] if proxy else video_path
+    prepared = prepare_coarse_matcher(coarse_path, matcher, coarse_width, proxy and proxy['reference_width'])
+    if prepared is None:
+        return None
+    fps, coarse_matcher, threshold_ratio = prepared
+    step = max(1, int(round(sample_interval * fps)))
+
+    start_frame = 0
+    while True:
+        candidate = find_first_match_sharded(coarse_path, coarse_matcher, sensitivity * threshold_ratio,
+                                             sample_interval, strategy, shards=shards, start_frame=start_frame)
+        if candidate is None:
+            break
+
+        if proxy:
+            proxy['wait_for_video']()
+            hit = refine_proxy_candidate(video_path, matcher, sensitivity, candidate[1], sample_interval, found_frames)
+        else:
+            hit = refine_candidate(video_path, matcher, sensitivity, candidate[0], step, found_frames)
+        if hit is not None:
+            return hit
+        start_frame = candidate[0] + step
+
+    if coarse_matcher is matcher:
+        return None
+    print("Nothing confirmed on the coarse pass, scanning again at full resolution...")
+    if proxy:
+        proxy['wait_for_video']()
+    candidate = find_first_match_sharded(video_path, matcher, sensitivity, sample_interval, strategy, shards=shards)
+    if candidate is None:
+        return None
+    return refine_proxy_candidate(video_path, matcher, sensitivity, candidate[1], sample_interval, found_frames)
@@ -0,0 +1,134 @@
+import gc
+import os
+import threading
+import time
+
+# Model size used when a task doesn't ask for one ("tiny", "base", "small", ...).
+WHISPER_MODEL = os.environ.get('WHISPER_MODEL', 'base')
+# Load the default model as soon as a worker process starts instead of on the first task.
+WHISPER_PRELOAD = os.environ.get('WHISPER_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+# Models unused for this many seconds are dropped.
+WHISPER_IDLE_TIMEOUT = float(os.environ.get('WHISPER_IDLE_TIMEOUT', 1800))
+# Torch CPU threads per worker process (0 keeps torch's default of one per core).
+WHISPER_THREADS = int(os.environ.get('WHISPER_THREADS', 0))
+# Below this much available memory, every model not currently transcribing is dropped.
+WHISPER_MIN_FREE_MB = int(os.environ.get('WHISPER_MIN_FREE_MB', 1024))
+
+_models = {}
+_lock = threading.RLock()
+_reaper = None
+
+
+def available_memory_mb():
+    """MemAvailable from /proc/meminfo, or None where that isn't readable."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+def memory_is_tight():
+    available = available_memory_mb()
+    return available is not None and available < WHISPER_MIN_FREE_MB
+
+
+def get_model(size=None):
+    """
+    Returns (model, load_seconds) for `size`, loading it only if this process doesn't
+    already hold it. load_seconds is 0 for a warm model.
+    """
+    size = size or WHISPER_MODEL
+    with _lock:
+        entry = _models.get(size)
+        if entry is None:
+            if memory_is_tight():
+                evict_models(force=True)
+            import whisper
+            if WHISPER_THREADS:
+                import torch
+                torch.set_num_threads(WHISPER_THREADS)
+            print(f"Loading Whisper model '{size}'...")
+            started = time.perf_counter()
+            entry = {'model': whisper.load_model(size), 'in_use': 0}
+            entry['load_seconds'] = time.perf_counter() - started
+            print(f"Whisper model '{size}' loaded in {entry['load_seconds']:.1f}s.")
+            _models[size] = entry
+            load_seconds = entry['load_seconds']
+        else:
+            load_seconds = 0.0
+        entry['last_used'] = time.monotonic()
+        return entry['model'], load_seconds
+
+
+def transcribe(audio, size=None, **options):
+    """
+    Transcribes `audio` (a path or a 16kHz float32 array) with a pooled model.
+    Returns (whisper_result, timings) with model load and inference time kept apart.
+    """
+    size = size or WHISPER_MODEL
+    with _lock:
+        model, load_seconds = get_model(size)
+        _models[size]['in_use'] += 1
+    try:
+        started = time.perf_counter()
+        result = model.transcribe(audio, **options)
+        inference_seconds = time.perf_counter() - started
+    finally:
+        with _lock:
+            _models[size]['in_use'] -= 1
+            _models[size]['last_used'] = time.monotonic()
+    return result, {'model_load': load_seconds, 'transcription': inference_seconds}
+
+
+def evict_models(force=False):
+    """
+    Drops models idle past WHISPER_IDLE_TIMEOUT, or every idle model when `force` is set
+    or memory is tight. Models in the middle of a transcription are never dropped.
+    """
+    force = force or memory_is_tight()
+    now = time.monotonic()
+    evicted = []
+    with _lock:
+        for size, entry in list(_models.items()):
+            if entry['in_use']:
+                continue
+            if force or now - entry['last_used'] > WHISPER_IDLE_TIMEOUT:
+                del _models[size]
+                evicted.append(size)
+    if evicted:
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        print(f"Evicted Whisper model(s): {', '.join(evicted)}")
+    return evicted
+
+
+def _reap_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            evict_models()
+        except Exception as e:
+            print(f"Error evicting Whisper models: {e}")
+
+
+def start(preload=WHISPER_PRELOAD, reap_interval=60):
+    """
+    Called once per worker process: starts the idle reaper and optionally warms the
+    default model. The preload runs in the background because Celery gives
+    worker_process_init only a few seconds; a task arriving meanwhile waits on the lock.
+    """
+    global _reaper
+    if _reaper is None:
+        _reaper = threading.Thread(target=_reap_forever, args=(reap_interval,), daemon=True, name='whisper-reaper')
+        _reaper.start()
+    if preload:
+        threading.Thread(target=get_model, daemon=True, name='whisper-preload').start()